@@ -7,7 +7,7 @@ from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request as GoogleRequest
 import os
 from dotenv import load_dotenv
-import json
+import orjson
 import requests
 from datetime import datetime, timedelta
 import threading
@@ -19,22 +19,46 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 import io
 import base64
+import tempfile
+import hashlib
+from collections import OrderedDict
+import traceback
 
-from retrieval_service import openai_api_utils
+from retrieval_service import openai_api_utils, react_agent_utils
 from retrieval_service.agent import REACT_SYSTEM_PROMPT
 from retrieval_service.google_api_utils import initialize_user_data
-from retrieval_service.supabase_utils import get_user_by_email, create_user
-from fastapi.responses import StreamingResponse
-import json
+from retrieval_service.supabase_utils import get_user_by_email, create_user, supabase
 from retrieval_service.ocr_utils import init_model
 
 load_dotenv()
-print("Loading OCR model...")
-init_model(['en'])
-print("OCR model loaded.")
 
 app = FastAPI()
 
+
+def warm_connections():
+    """
+    Open the shared Supabase connection pool before the first request.
+    All users share this one client (its HTTP pool keeps connections alive),
+    so one cheap query up front takes the TLS handshake off the first search.
+    """
+    try:
+        supabase.table("users").select("id").limit(1).execute()
+        print("[STARTUP] Supabase connection pool warmed")
+    except Exception as e:
+        print(f"[STARTUP] Supabase warm-up failed (continuing): {e}")
+
+
+@app.on_event("startup")
+async def on_startup():
+    # Loaded here rather than at import: document-extraction worker processes
+    # are spawned and re-import this module, and must not each load the model
+    print("Loading OCR model...")
+    init_model(['en'])
+    print("OCR model loaded.")
+    
+    # Don't hold up startup on the network; warm in the background
+    asyncio.get_running_loop().run_in_executor(None, warm_connections)
+
 # User info cache to reduce Google API calls
 # Structure: {token_hash: {"user_info": {...}, "expires_at": timestamp}}
 user_info_cache: Dict[str, Dict] = {}
@@ -43,7 +67,6 @@ cache_lock = threading.Lock()
 
 def get_token_hash(token: str) -> str:
     """Create a hash of the token for cache key"""
-    import hashlib
     return hashlib.sha256(token.encode()).hexdigest()
 
 def get_cached_user_info(token: str) -> Optional[dict]:
@@ -75,6 +98,78 @@ def clear_cached_user_info(token: str):
         if token_hash in user_info_cache:
             del user_info_cache[token_hash]
 
+# Refreshed access tokens, keyed by refresh token hash. The refreshed token is
+# never written back to the cookie, so without this every request made with an
+# expired access token would hit Google's token endpoint again.
+# Structure: {refresh_token_hash: {"token": str, "expiry": datetime}}, LRU-bounded
+REFRESHED_TOKEN_CACHE_MAX_ENTRIES = 1024
+refreshed_token_cache: OrderedDict = OrderedDict()
+
+def get_cached_refreshed_token(refresh_token: str) -> Optional[dict]:
+    """Get the last refreshed access token for a refresh token, if still valid"""
+    with cache_lock:
+        token_hash = get_token_hash(refresh_token)
+        cached = refreshed_token_cache.get(token_hash)
+        if cached is None:
+            return None
+        # Credentials.expiry is naive UTC
+        if cached["expiry"] is None or cached["expiry"] <= datetime.utcnow():
+            del refreshed_token_cache[token_hash]
+            return None
+        refreshed_token_cache.move_to_end(token_hash)
+        return cached
+
+def set_cached_refreshed_token(refresh_token: str, credentials: Credentials):
+    """Remember a freshly refreshed access token"""
+    with cache_lock:
+        token_hash = get_token_hash(refresh_token)
+        refreshed_token_cache[token_hash] = {
+            "token": credentials.token,
+            "expiry": credentials.expiry,
+        }
+        refreshed_token_cache.move_to_end(token_hash)
+        while len(refreshed_token_cache) > REFRESHED_TOKEN_CACHE_MAX_ENTRIES:
+            refreshed_token_cache.popitem(last=False)
+
+def clear_cached_refreshed_token(refresh_token: str):
+    """Forget the refreshed access token for a refresh token"""
+    with cache_lock:
+        refreshed_token_cache.pop(get_token_hash(refresh_token), None)
+
+# Downloads are buffered in memory up to this size, then spill to a temp file
+DOWNLOAD_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+def iter_file_chunks(file_obj, chunk_size: int = DOWNLOAD_CHUNK_BYTES):
+    """Yield a file's remaining content in fixed-size chunks, closing it afterwards"""
+    try:
+        while True:
+            chunk = file_obj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file_obj.close()
+
+def format_sse_event(event: dict) -> bytes:
+    """Serialize an event as a server-sent events data frame (UTF-8, via orjson)"""
+    return b"data: " + orjson.dumps(event) + b"\n\n"
+
+# Static system prompt text goes first and per-request values (time, user info)
+# last, so repeated requests share the longest possible prompt prefix and
+# hit the model provider's prefix cache
+DOWNLOAD_LINK_INSTRUCTIONS = (
+    "When you want to provide download links, use the format: [Title](URL)\n"
+    "The download link can be obtained from the ids of attachments or drive files:\n"
+    "- For Google Drive files, use http://localhost:8080/api/download/drive-direct/{file_db_id}\n"
+    "- For Gmail attachments, use http://localhost:8080/api/download/attachment-direct/{attachment_db_id}\n"
+)
+MIXED_SYSTEM_PROMPT_PREFIX = REACT_SYSTEM_PROMPT + "\n\n" + DOWNLOAD_LINK_INSTRUCTIONS
+BASIC_SYSTEM_PROMPT_PREFIX = (
+    "You are a helpful assistant with access to the user's personal data.\n\n"
+    + DOWNLOAD_LINK_INSTRUCTIONS
+)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -221,7 +316,6 @@ async def google_callback(request: Request, code: str = None, state: str = None)
             if "expires_in" in token_info:
                 credentials.expiry = datetime.utcnow() + timedelta(seconds=token_info["expires_in"])
         except Exception as token_error:
-            import traceback
             return JSONResponse(
                 {
                     "error": f"Failed to fetch token: {str(token_error)}",
@@ -235,7 +329,6 @@ async def google_callback(request: Request, code: str = None, state: str = None)
 
         # Get user info
         try:
-            from googleapiclient.discovery import build
             service = build("oauth2", "v2", credentials=credentials)
             user_info = service.userinfo().get().execute()
             user_email = user_info.get("email")
@@ -284,7 +377,6 @@ async def google_callback(request: Request, code: str = None, state: str = None)
 
         return response
     except Exception as e:
-        import traceback
         return JSONResponse(
             {"error": str(e), "traceback": traceback.format_exc()}, 
             status_code=500
@@ -310,17 +402,23 @@ def get_credentials_from_cookies(request: Request) -> Credentials | None:
 
     if token_expiry:
         try:
-            from datetime import datetime
             credentials.expiry = datetime.fromisoformat(token_expiry)
         except:
             pass
 
-    # Refresh token if expired
+    # Refresh token if expired, reusing a previous refresh while it is still valid
     if credentials.expired and credentials.refresh_token:
-        try:
-            credentials.refresh(GoogleRequest())
-        except:
-            return None
+        cached = get_cached_refreshed_token(credentials.refresh_token)
+        if cached:
+            credentials.token = cached["token"]
+            credentials.expiry = cached["expiry"]
+
+        if credentials.expired:
+            try:
+                credentials.refresh(GoogleRequest())
+            except:
+                return None
+            set_cached_refreshed_token(credentials.refresh_token, credentials)
 
     return credentials
 
@@ -339,7 +437,6 @@ async def get_profile(request: Request):
             return cached_info
         
         # Cache miss - fetch from Google
-        from googleapiclient.discovery import build
         service = build("oauth2", "v2", credentials=credentials)
         user_info = service.userinfo().get().execute()
         
@@ -362,7 +459,6 @@ async def auth_status(request: Request):
             
             if not user_info:
                 # Cache miss - fetch from Google
-                from googleapiclient.discovery import build
                 service = build("oauth2", "v2", credentials=credentials)
                 user_info = service.userinfo().get().execute()
                 
@@ -403,6 +499,8 @@ async def logout(request: Request):
     # Clear cache for this token
     if credentials and credentials.token:
         clear_cached_user_info(credentials.token)
+        if credentials.refresh_token:
+            clear_cached_refreshed_token(credentials.refresh_token)
         
         # Revoke the token with Google
         try:
@@ -439,7 +537,6 @@ async def chat(request: Request):
     try:
         user_info = get_cached_user_info(credentials.token)
         if not user_info:
-            from googleapiclient.discovery import build
             service = build("oauth2", "v2", credentials=credentials)
             user_info = service.userinfo().get().execute()
             set_cached_user_info(credentials.token, user_info)
@@ -466,23 +563,14 @@ async def chat(request: Request):
         # Build system message based on mode
         if mode == "mixed":
             # Mixed mode: RAG + optional tool calling
-            system_content = REACT_SYSTEM_PROMPT + (
-                f"\n\nCurrent date and time: {current_datetime} ({weekday_name}).\n"
-                f"User info JSON (for your reference, do NOT leak sensitive fields verbatim):\n{user_info}\n\n"
-                f"When you want to provide download links, use the format: [Title](URL)\n"
-                f"The download link can be obtained from the ids of attachments or drive files:\n"
-                f"- For Google Drive files, use http://localhost:8080/api/download/drive-direct/{{file_db_id}}\n"
-                f"- For Gmail attachments, use http://localhost:8080/api/download/attachment-direct/{{attachment_db_id}}\n"
+            system_content = MIXED_SYSTEM_PROMPT_PREFIX + (
+                f"\nCurrent date and time: {current_datetime} ({weekday_name}).\n"
+                f"User info JSON (for your reference, do NOT leak sensitive fields verbatim):\n{user_info}\n"
             )
         else:
             # RAG and React modes use simpler system prompt (React has its own in react_agent_utils)
-            system_content = (
-                f"You are a helpful assistant with access to the user's personal data.\n"
-                f"Current date and time: {current_datetime} ({weekday_name}).\n\n"
-                f"When you want to provide download links, use the format: [Title](URL)\n"
-                f"The download link can be obtained from the ids of attachments or drive files:\n"
-                f"- For Google Drive files, use http://localhost:8080/api/download/drive-direct/{{file_db_id}}\n"
-                f"- For Gmail attachments, use http://localhost:8080/api/download/attachment-direct/{{attachment_db_id}}\n"
+            system_content = BASIC_SYSTEM_PROMPT_PREFIX + (
+                f"\nCurrent date and time: {current_datetime} ({weekday_name}).\n"
             )
 
         system_message = {
@@ -501,26 +589,24 @@ async def chat(request: Request):
             try:
                 if mode == "react":
                     # Real ReAct agent with Thought-Action-Observation loop
-                    from retrieval_service import react_agent_utils
                     async for event in react_agent_utils.react_agent_stream(messages, user_id):
-                        yield "data: " + json.dumps(event, ensure_ascii=False) + "\n\n"
+                        yield format_sse_event(event)
                         await asyncio.sleep(0)
                 elif mode == "mixed":
                     # Mixed mode: RAG + optional tool calling
                     async for event in openai_api_utils.react_with_tools_stream(messages, user_id):
-                        yield "data: " + json.dumps(event, ensure_ascii=False) + "\n\n"
+                        yield format_sse_event(event)
                         await asyncio.sleep(0)
                 else:
                     # Direct RAG mode (default)
                     async for event in openai_api_utils.rag_direct_stream(messages, user_id, user_message, user_info):
-                        yield "data: " + json.dumps(event, ensure_ascii=False) + "\n\n"
+                        yield format_sse_event(event)
                         await asyncio.sleep(0)
             except Exception as e:
-                import traceback
                 print(f"[CHAT ERROR] {e}")
                 print(traceback.format_exc())
                 err = {"type": "error", "error": str(e)}
-                yield "data: " + json.dumps(err, ensure_ascii=False) + "\n\n"
+                yield format_sse_event(err)
 
         return StreamingResponse(
             generate(),
@@ -533,13 +619,60 @@ async def chat(request: Request):
         )
 
     except Exception as e:
-        import traceback
         return JSONResponse(
             {"error": str(e), "traceback": traceback.format_exc()},
             status_code=500,
         )
 
 
+def download_drive_file_to_spool(credentials, file_id: str):
+    """
+    Blocking Drive download into a spooled temp file.
+    Returns (download_name, file_obj) with file_obj rewound to the start.
+    """
+    service = build("drive", "v3", credentials=credentials)
+
+    # 1. Get metadata to check type
+    meta = service.files().get(
+        fileId=file_id,
+        fields="id, name, mimeType"
+    ).execute()
+
+    name = meta["name"]
+    mime_type = meta["mimeType"]
+
+    # 2. Handle Workspace exports
+    export_map = {
+        "application/vnd.google-apps.document":
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "application/vnd.google-apps.spreadsheet":
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "application/vnd.google-apps.presentation":
+            "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    }
+
+    # 3. Download
+    if mime_type in export_map:
+        request_drive = service.files().export_media(
+            fileId=file_id,
+            mimeType=export_map[mime_type]
+        )
+        download_name = f"{name}.docx"
+    else:
+        request_drive = service.files().get_media(fileId=file_id)
+        download_name = name
+
+    file_bytes = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_MAX_BYTES)
+    downloader = MediaIoBaseDownload(file_bytes, request_drive)
+
+    done = False
+    while not done:
+        status, done = downloader.next_chunk()
+
+    file_bytes.seek(0)
+    return download_name, file_bytes
+
+
 @app.get("/api/download/drive-direct/{file_id}")
 async def download_drive_file_direct(file_id: str, request: Request):
     """
@@ -551,49 +684,13 @@ async def download_drive_file_direct(file_id: str, request: Request):
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
 
     try:
-        service = build("drive", "v3", credentials=credentials)
-
-        # 1. Get metadata to check type
-        meta = service.files().get(
-            fileId=file_id,
-            fields="id, name, mimeType"
-        ).execute()
-
-        name = meta["name"]
-        mime_type = meta["mimeType"]
-
-        # 2. Handle Workspace exports
-        export_map = {
-            "application/vnd.google-apps.document":
-                "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            "application/vnd.google-apps.spreadsheet":
-                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            "application/vnd.google-apps.presentation":
-                "application/vnd.openxmlformats-officedocument.presentationml.presentation",
-        }
-
-        # 3. Download
-        if mime_type in export_map:
-            request_drive = service.files().export_media(
-                fileId=file_id,
-                mimeType=export_map[mime_type]
-            )
-            download_name = f"{name}.docx"
-        else:
-            request_drive = service.files().get_media(fileId=file_id)
-            download_name = name
-
-        file_bytes = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_bytes, request_drive)
-
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-
-        file_bytes.seek(0)
+        # Run the blocking download in a worker thread so concurrent downloads overlap
+        download_name, file_bytes = await asyncio.to_thread(
+            download_drive_file_to_spool, credentials, file_id
+        )
 
         return StreamingResponse(
-            file_bytes,
+            iter_file_chunks(file_bytes),
             media_type="application/octet-stream",
             headers={
                 "Content-Disposition": f'attachment; filename="{download_name}"'
@@ -615,8 +712,10 @@ async def download_attachment_direct(attachment_id: str, request: Request):
 
     try:
         # 1. Look up attachment metadata in DB
-        from retrieval_service.supabase_utils import supabase
-        resp = supabase.table("attachments").select("*").eq("id", attachment_id).execute()
+        # Blocking client calls run in worker threads so concurrent downloads overlap
+        resp = await asyncio.to_thread(
+            supabase.table("attachments").select("*").eq("id", attachment_id).execute
+        )
 
         if not resp.data:
             return JSONResponse({"error": "Attachment not found"}, status_code=404)
@@ -629,11 +728,13 @@ async def download_attachment_direct(attachment_id: str, request: Request):
         service = build("gmail", "v1", credentials=credentials)
 
         # 3. Fetch attachment data
-        att = service.users().messages().attachments().get(
-            userId="me",
-            messageId=message_id,
-            id=attachment_id
-        ).execute()
+        att = await asyncio.to_thread(
+            service.users().messages().attachments().get(
+                userId="me",
+                messageId=message_id,
+                id=attachment_id
+            ).execute
+        )
 
         raw_data = att.get("data")
         if not raw_data:
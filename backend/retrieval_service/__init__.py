@@ -0,0 +1,7 @@
+"""
+Retrieval service package.
+
+Nothing is re-exported here on purpose: callers import the submodule they
+need (e.g. ``retrieval_service.gemni_api_utils``) so that loading one helper
+does not pull in the OpenAI, Google and Supabase SDKs behind the others.
+"""
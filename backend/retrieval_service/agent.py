@@ -1,8 +1,15 @@
-import json
-
-from retrieval_service import openai_api_utils
 from retrieval_service.search_utils import DEFAULT_TOP_K
 
+# Shared by every tool schema below; the same object is reused rather than
+# rebuilt once per tool.
+_TOP_K_PARAM = {
+    "type": "integer",
+    "description": "Maximum number of results to retrieve.",
+    "minimum": 1,
+    "maximum": 50,
+    "default": DEFAULT_TOP_K
+}
+
 SEARCH_TOOLS = [
     {
         "type": "function",
@@ -29,13 +36,7 @@ SEARCH_TOOLS = [
                             ]
                         }
                     },
-                    "top_k": {
-                        "type": "integer",
-                        "description": "Maximum number of results to retrieve.",
-                        "minimum": 1,
-                        "maximum": 50,
-                        "default": DEFAULT_TOP_K
-                    }
+                    "top_k": _TOP_K_PARAM
                 },
                 "required": ["query"]
             }
@@ -58,13 +59,7 @@ SEARCH_TOOLS = [
                         "description": "Optional explicit keywords chosen by you. If omitted, the server will split the query into words.",
                         "items": {"type": "string"}
                     },
-                    "top_k": {
-                        "type": "integer",
-                        "description": "Maximum number of results to retrieve.",
-                        "minimum": 1,
-                        "maximum": 50,
-                        "default": DEFAULT_TOP_K
-                    }
+                    "top_k": _TOP_K_PARAM
                 },
                 "required": ["query"]
             }
@@ -82,13 +77,7 @@ SEARCH_TOOLS = [
                         "type": "string",
                         "description": "The approximate text to match."
                     },
-                    "top_k": {
-                        "type": "integer",
-                        "description": "Maximum number of results to retrieve.",
-                        "minimum": 1,
-                        "maximum": 50,
-                        "default": DEFAULT_TOP_K
-                    }
+                    "top_k": _TOP_K_PARAM
                 },
                 "required": ["query"]
             }
@@ -34,26 +34,39 @@ def isDOC(filename: str) -> bool:
 
 # ========== Extractors ==========
 
-def extract_text_from_pdf(data: bytes) -> str:
-    """Extract text from PDF bytes using PyMuPDF."""
+def extract_text_from_pdf(data: bytes, max_chars: Optional[int] = None) -> str:
+    """Extract text from PDF bytes using PyMuPDF (stops after about max_chars)."""
     text_chunks = []
+    total = 0
 
     with fitz.open(stream=data, filetype="pdf") as doc:
         for page in doc:
             t = page.get_text()
             if t:
                 text_chunks.append(t)
+                total += len(t) + 1
+                if max_chars is not None and total >= max_chars:
+                    break
 
     return "\n".join(text_chunks).strip()
 
 
-def extract_text_from_docx(data: bytes) -> str:
-    """Extract text from DOCX bytes."""
+def extract_text_from_docx(data: bytes, max_chars: Optional[int] = None) -> str:
+    """Extract text from DOCX bytes (stops after about max_chars)."""
     file_like = io.BytesIO(data)
     doc = Document(file_like)
-    return "\n".join(
-        para.text for para in doc.paragraphs if para.text.strip()
-    )
+    text_chunks = []
+    total = 0
+
+    for para in doc.paragraphs:
+        t = para.text
+        if t.strip():
+            text_chunks.append(t)
+            total += len(t) + 1
+            if max_chars is not None and total >= max_chars:
+                break
+
+    return "\n".join(text_chunks)
 
 
 def extract_text_from_doc(data: bytes) -> str:
@@ -83,16 +96,20 @@ def extract_text_from_md(data: bytes) -> str:
     return extract_text_from_txt(data)
 
 
-def extract_text_from_pptx(data: bytes) -> str:
-    """Extract text from PPTX bytes."""
+def extract_text_from_pptx(data: bytes, max_chars: Optional[int] = None) -> str:
+    """Extract text from PPTX bytes (stops after about max_chars)."""
     file_like = io.BytesIO(data)
     prs = Presentation(file_like)
 
     text_chunks = []
+    total = 0
     for slide in prs.slides:
         for shape in slide.shapes:
             if hasattr(shape, "text") and shape.text.strip():
                 text_chunks.append(shape.text)
+                total += len(shape.text) + 1
+        if max_chars is not None and total >= max_chars:
+            break
 
     return "\n".join(text_chunks).strip()
 
@@ -102,23 +119,38 @@ def extract_text_from_ppt(data: bytes) -> str:
     return "[Legacy .ppt parsing not implemented — convert to .pptx]"
 
 
-def extract_text_from_xlsx(data: bytes) -> str:
-    """Extract text from XLSX bytes."""
+def extract_text_from_xlsx(data: bytes, max_chars: Optional[int] = None) -> str:
+    """Extract text from XLSX bytes (stops after about max_chars)."""
     file_like = io.BytesIO(data)
-    wb = openpyxl.load_workbook(file_like, data_only=True)
+    # read_only streams rows from the sheet XML instead of building every
+    # cell object up front (constant memory on large workbooks)
+    wb = openpyxl.load_workbook(file_like, data_only=True, read_only=True)
     text_chunks = []
+    total = 0
 
-    for sheet in wb.worksheets:
-        for row in sheet.iter_rows(values_only=True):
-            for cell in row:
-                if cell is not None:
-                    text_chunks.append(str(cell))
+    try:
+        for sheet in wb.worksheets:
+            # Read-only sheets trust the stored dimensions, which some
+            # writers get wrong; drop them so every row is read
+            sheet.reset_dimensions()
+            for row in sheet.iter_rows(values_only=True):
+                for cell in row:
+                    if cell is not None:
+                        t = str(cell)
+                        text_chunks.append(t)
+                        total += len(t) + 1
+                if max_chars is not None and total >= max_chars:
+                    break
+            if max_chars is not None and total >= max_chars:
+                break
+    finally:
+        wb.close()
 
     return "\n".join(text_chunks).strip()
 
 
-def extract_text_from_xls(data: bytes) -> str:
-    """Legacy XLS — limited support unless xlrd installed."""
+def extract_text_from_xls(data: bytes, max_chars: Optional[int] = None) -> str:
+    """Legacy XLS — limited support unless xlrd installed (stops after about max_chars)."""
     try:
         import xlrd
     except ImportError:
@@ -127,11 +159,20 @@ def extract_text_from_xls(data: bytes) -> str:
     file_like = io.BytesIO(data)
     book = xlrd.open_workbook(file_contents=data)
     text_chunks = []
+    total = 0
 
     for sheet in book.sheets():
         for row_idx in range(sheet.nrows):
             cells = sheet.row_values(row_idx)
-            text_chunks.extend(str(c) for c in cells if c)
+            for c in cells:
+                if c:
+                    t = str(c)
+                    text_chunks.append(t)
+                    total += len(t) + 1
+            if max_chars is not None and total >= max_chars:
+                break
+        if max_chars is not None and total >= max_chars:
+            break
 
     return "\n".join(text_chunks).strip()
 
@@ -148,14 +189,17 @@ def extractDOC(data: bytes, filename: Optional[str] = None, max_chars: int = 150
         raise ValueError("filename is required to detect document type")
 
     name = filename.lower()
+    # Extractors stop once they have this much text; the headroom covers
+    # whitespace cleanup before the final cut below
+    budget = max_chars + max_chars // 5
 
     try:
         # Determine extractor
         if name.endswith(".pdf"):
-            text = extract_text_from_pdf(data)
+            text = extract_text_from_pdf(data, budget)
 
         elif name.endswith(".docx"):
-            text = extract_text_from_docx(data)
+            text = extract_text_from_docx(data, budget)
 
         elif name.endswith(".doc"):
             text = extract_text_from_doc(data)
@@ -167,16 +211,16 @@ def extractDOC(data: bytes, filename: Optional[str] = None, max_chars: int = 150
             text = extract_text_from_md(data)
 
         elif name.endswith(".pptx"):
-            text = extract_text_from_pptx(data)
+            text = extract_text_from_pptx(data, budget)
 
         elif name.endswith(".ppt"):
             text = extract_text_from_ppt(data)
 
         elif name.endswith(".xlsx"):
-            text = extract_text_from_xlsx(data)
+            text = extract_text_from_xlsx(data, budget)
 
         elif name.endswith(".xls"):
-            text = extract_text_from_xls(data)
+            text = extract_text_from_xls(data, budget)
 
         else:
             raise ValueError(f"Unsupported document format: {filename}")
@@ -1,8 +1,18 @@
 # gemeni_api_utils.py
 
 import os
+import re
+import time
+import hashlib
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from array import array
+from collections import OrderedDict
 import google.generativeai as genai
 from dotenv import load_dotenv
+from retrieval_service.retry_utils import with_retry
+from retrieval_service.rate_limit_utils import gemini_limiter
 
 load_dotenv()
 
@@ -10,11 +20,11 @@ load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 
+@with_retry(retries=3, base=1.0, label="Gemini embed_content")
 def embed_text(
     text: str,
     model: str = "gemini-embedding-001",
     dim: int = 1536,
-    max_retries: int = 3,
 ):
     """
     Generate a text embedding using Gemini with retry logic.
@@ -23,34 +33,196 @@ def embed_text(
         text (str): Input text.
         model (str): Gemini embedding model.
         dim (int): Output dimensionality (e.g., 768, 1536, 3072).
-        max_retries (int): Maximum number of retry attempts.
 
     Returns:
         list: Embedding vector.
     """
-    import time
-    
-    for attempt in range(max_retries):
+    gemini_limiter.acquire()
+    result = genai.embed_content(
+        model=model,
+        content=text,
+        output_dimensionality=dim,
+    )
+    return result["embedding"]
+
+
+@with_retry(retries=3, base=1.0, label="Gemini batch embed_content")
+def embed_texts(
+    texts: list,
+    model: str = "gemini-embedding-001",
+    dim: int = 1536,
+):
+    """
+    Embed several texts with a single Gemini request.
+
+    Args:
+        texts (list): Input texts.
+        model (str): Gemini embedding model.
+        dim (int): Output dimensionality.
+
+    Returns:
+        list: One embedding vector per input text, in order.
+    """
+    gemini_limiter.acquire()
+    result = genai.embed_content(
+        model=model,
+        content=texts,
+        output_dimensionality=dim,
+    )
+    return result["embedding"]
+
+
+# ======================================================
+# Embedding micro-batcher
+# ======================================================
+
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_MAX_WAIT = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5")) / 1000
+# Batches in flight at once, so one batch stuck in retry backoff doesn't stall the rest
+EMBED_BATCH_FLUSH_WORKERS = int(os.getenv("EMBED_BATCH_FLUSH_WORKERS", "4"))
+
+
+class EmbedBatcher:
+    """
+    Coalesce concurrent single-text embedding calls into batched requests.
+
+    Callers block on embed(); a background thread collects whatever arrives
+    within max_wait of the first pending text (up to max_batch texts) and
+    sends them as one embed_content call on a small flush pool. Under
+    concurrent load this turns N embedding RPCs into roughly one per window;
+    a lone caller pays at most max_wait extra. If a batch fails, each text
+    is retried on its own so only the failing callers see an error.
+    """
+
+    def __init__(self, model: str = "gemini-embedding-001", dim: int = 1536,
+                 max_batch: int = EMBED_BATCH_MAX_SIZE, max_wait: float = EMBED_BATCH_MAX_WAIT):
+        self.model = model
+        self.dim = dim
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._flush_executor = ThreadPoolExecutor(max_workers=EMBED_BATCH_FLUSH_WORKERS, thread_name_prefix="embed-flush")
+
+    def embed(self, text: str) -> list:
+        """Embed one text, sharing a request with other concurrent callers."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush_executor.submit(self._flush, batch)
+
+    def _flush(self, batch):
+        # Identical texts in one window share a single slot in the request
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        results = {}
         try:
-            result = genai.embed_content(
-                model=model,
-                content=text,
-                output_dimensionality=dim,
-            )
-            return result["embedding"]
+            if len(texts) == 1:
+                vectors = [embed_text(texts[0], model=self.model, dim=self.dim)]
+            else:
+                vectors = embed_texts(texts, model=self.model, dim=self.dim)
+            results = dict(zip(texts, vectors))
         except Exception as e:
-            error_str = str(e)
-            # Check if it's a retryable error (timeout, rate limit, server error)
-            is_retryable = any(code in error_str for code in ["504", "503", "429", "500", "Deadline", "timeout", "Too Many Requests"])
-            
-            if attempt < max_retries - 1 and is_retryable:
-                # Exponential backoff: 1s, 2s, 4s
-                wait_time = 1 * (2 ** attempt)
-                print(f"Gemini API error (attempt {attempt + 1}/{max_retries}): {e}. Retrying in {wait_time}s...")
-                time.sleep(wait_time)
+            if len(texts) == 1:
+                results[texts[0]] = e
+            else:
+                print(f"[EMBED] Batch of {len(texts)} failed, retrying per text: {e}")
+                for text in texts:
+                    try:
+                        results[text] = embed_text(text, model=self.model, dim=self.dim)
+                    except Exception as text_error:
+                        results[text] = text_error
+
+        for text, future in batch:
+            result = results[text]
+            if isinstance(result, Exception):
+                future.set_exception(result)
             else:
-                # Non-retryable error or final attempt
-                print(f"Gemini API error after {max_retries} attempts: {e}")
-                raise
-    
-    raise Exception("Failed to embed text after all retries")
+                future.set_result(result)
+
+
+_query_batcher = EmbedBatcher()
+
+
+# ======================================================
+# Query embedding cache
+# ======================================================
+
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "1024"))
+QUERY_EMBEDDING_CACHE_TTL = int(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+_query_embedding_cache: OrderedDict = OrderedDict()
+_query_embedding_cache_lock = threading.Lock()
+
+# Sentence punctuation and quotes around a query don't change what is being asked
+# (symbols such as "C++" or "C#" are kept)
+_QUERY_EDGE_PUNCT_RE = re.compile(r"^[\"'`(\[]+|[\"'`)\].,!?;:]+$")
+
+
+def normalize_query(query: str) -> str:
+    """Cache-key form of a query: collapsed whitespace, lowercase, no edge punctuation."""
+    return _QUERY_EDGE_PUNCT_RE.sub("", " ".join(query.split()).lower())
+
+
+def embed_query(
+    query: str,
+    model: str = "gemini-embedding-001",
+    dim: int = 1536,
+):
+    """
+    Embed a search query, reusing the vector for a query seen recently.
+
+    Follow-ups, UI retries and repeated prompts embed the same text over and
+    over with trivial variations; an LRU keyed on a SHA-256 of the
+    normalized query (see normalize_query; hashing keeps long queries from
+    pinning their text in memory) skips those RPCs. Entries
+    expire after QUERY_EMBEDDING_CACHE_TTL seconds. Vectors are stored as
+    packed float32 (~6 KB each rather than ~50 KB as a list of floats); the
+    model's output is float32 precision, so nothing is lost.
+    Document embeddings should keep using embed_text.
+
+    Returns:
+        list: Embedding vector.
+    """
+    text = " ".join(query.split())
+    key = hashlib.sha256(f"{model}\x00{dim}\x00{normalize_query(text)}".encode()).digest()
+    now = time.monotonic()
+    with _query_embedding_cache_lock:
+        cached = _query_embedding_cache.get(key)
+        if cached is not None:
+            if cached[0] > now:
+                _query_embedding_cache.move_to_end(key)
+                return cached[1].tolist()
+            del _query_embedding_cache[key]
+
+    if model == _query_batcher.model and dim == _query_batcher.dim:
+        embedding = _query_batcher.embed(text)
+    else:
+        embedding = embed_text(text, model=model, dim=dim)
+
+    with _query_embedding_cache_lock:
+        _query_embedding_cache[key] = (now + QUERY_EMBEDDING_CACHE_TTL, array("f", embedding))
+        _query_embedding_cache.move_to_end(key)
+        while len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_MAX_ENTRIES:
+            _query_embedding_cache.popitem(last=False)
+    return embedding
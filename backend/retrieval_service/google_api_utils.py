@@ -1,68 +1,188 @@
-import time
+import os
+import re
+import heapq
 import io
+import base64
 import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+from google.auth.transport.requests import AuthorizedSession
 from email.utils import parsedate_to_datetime
 from retrieval_service.openai_api_utils import summarize_doc, summarize
 from retrieval_service.supabase_utils import (
-    get_emails_by_thread,
-    get_attachments_by_email,
+    get_emails_by_threads,
+    build_attachments_index,
     insert_embedding,
     batch_insert_embeddings,
-    update_file_summary,
-    update_attachment_summary,
+    update_file_summaries,
+    update_attachment_summaries,
     update_user_status
 )
-from retrieval_service.gemni_api_utils import embed_text
-from retrieval_service.thread_pool_manager import get_thread_pool_manager
+from retrieval_service.gemni_api_utils import embed_text, embed_texts
+from retrieval_service.thread_pool_manager import get_thread_pool_manager, MAX_FETCH_WORKERS
+from retrieval_service.rate_limit_utils import TokenBucket, GMAIL_REQUESTS_PER_SECOND, DRIVE_REQUESTS_PER_SECOND
+from retrieval_service.retry_utils import with_retry, is_retryable_error
 
 from retrieval_service.ocr_utils import extractOCR, isIMG
 from retrieval_service.doc_utils import extractDOC, isDOC
 from datetime import datetime, timezone, timedelta
 
+# Maps the URL-safe base64 alphabet Gmail uses onto the standard one, so
+# attachments can be decoded with the C-level b64decode directly.
+_URLSAFE_TRANS = bytes.maketrans(b"-_", b"+/")
+
+# Fast path for the RFC 2822 dates Gmail emits ("Tue, 14 Nov 2023 10:15:30 -0800");
+# anything else falls back to email.utils.parsedate_to_datetime.
+_DATE_RE = re.compile(
+    r"^\s*(?:[A-Za-z]{3},\s*)?(\d{1,2})\s+([A-Za-z]{3})\s+(\d{4})\s+"
+    r"(\d{2}):(\d{2}):(\d{2})\s+([+-])(\d{2})(\d{2})\b"
+)
+_MONTHS = {
+    "Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+    "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12,
+}
+_TZ_CACHE = {}
+
+
+def parse_email_date(raw_date):
+    """Parse a Gmail Date header into an ISO 8601 string (None if unparseable)"""
+    m = _DATE_RE.match(raw_date)
+    if m:
+        day, mon, year, hh, mm, ss, sign, off_h, off_m = m.groups()
+        month = _MONTHS.get(mon.title())
+        # "-0000" means "no zone information"; let the stdlib keep it naive
+        if month and not (sign == "-" and off_h == "00" and off_m == "00"):
+            offset = (int(off_h) * 60 + int(off_m)) * (-1 if sign == "-" else 1)
+            tz = _TZ_CACHE.get(offset)
+            if tz is None:
+                tz = _TZ_CACHE.setdefault(offset, timezone(timedelta(minutes=offset)))
+            try:
+                return datetime(int(year), month, int(day), int(hh), int(mm), int(ss), tzinfo=tz).isoformat()
+            except ValueError:
+                pass
+    try:
+        return parsedate_to_datetime(raw_date).isoformat()
+    except Exception:
+        return None
+
+
+# ======================================================
+# Google API service cache
+# ======================================================
+
+_service_cache = threading.local()
+
+
+def get_google_service(api: str, version: str, credentials):
+    """
+    Return a Google API service for these credentials, reusing one per thread.
+
+    Service objects (and their HTTP connections) are not thread-safe, so the
+    cache is thread-local; within a worker thread, repeated calls share one
+    authorized connection instead of rebuilding the client every time.
+    """
+    services = getattr(_service_cache, "services", None)
+    if services is None:
+        services = _service_cache.services = {}
+
+    key = (api, version, id(credentials))
+    entry = services.get(key)
+    # Keep the credentials alongside the service so a recycled id() can't match
+    if entry is None or entry[0] is not credentials:
+        # Bundled discovery docs: no network fetch and no discovery file cache
+        service = build(api, version, credentials=credentials, static_discovery=True, cache_discovery=False)
+        entry = services[key] = (credentials, service)
+    return entry[1]
+
+
+@with_retry(retries=3, base=1.0, label="Google API request")
+def execute_request(request):
+    """Execute a googleapiclient request, retrying rate limits and 5xx errors"""
+    return request.execute()
+
+
+def get_authorized_session(credentials):
+    """
+    Return a requests session authorized with these credentials, one per thread.
+
+    Used for raw media downloads, where streaming the response body directly
+    beats googleapiclient's chunked next_chunk() round trips.
+    """
+    sessions = getattr(_service_cache, "sessions", None)
+    if sessions is None:
+        sessions = _service_cache.sessions = {}
+
+    entry = sessions.get(id(credentials))
+    if entry is None or entry[0] is not credentials:
+        entry = sessions[id(credentials)] = (credentials, AuthorizedSession(credentials))
+    return entry[1]
+
 
 # ======================================================
 # Gmail: Fetch last 90 days emails (full pagination)
 # ======================================================
 
-async def fetch_gmail_messages(credentials, query="(category:primary OR label:sent) newer_than:90d", sleep_time=0.5, max_per_page=500):
-    service = build("gmail", "v1", credentials=credentials)
-    all_emails = []
+async def fetch_gmail_messages(credentials, query="(category:primary OR label:sent) newer_than:90d", max_per_page=500):
+    service = get_google_service("gmail", "v1", credentials)
+    # Gmail quota is per user, so each fetch gets its own bucket
+    limiter = TokenBucket(GMAIL_REQUESTS_PER_SECOND)
     all_attachments = []
     next_page_token = None
 
+    # Phase 1: drain every page of message IDs (list responses are small)
+    message_ids = []
     while True:
-        response = service.users().messages().list(
+        limiter.acquire()
+        response = execute_request(service.users().messages().list(
             userId="me",
             q=query,
             maxResults=max_per_page,
             pageToken=next_page_token
-        ).execute()
+        ))
 
-        refs = response.get("messages", [])
+        message_ids.extend(ref["id"] for ref in response.get("messages", []))
 
-        for ref in refs:
-            msg = service.users().messages().get(
+        next_page_token = response.get("nextPageToken")
+        if not next_page_token:
+            break
+
+    # Phase 2: fan out messages.get across worker threads (one service per thread)
+    def fetch_message(message_id):
+        worker_service = get_google_service("gmail", "v1", credentials)
+        limiter.acquire()
+        try:
+            return execute_request(worker_service.users().messages().get(
                 userId="me",
-                id=ref["id"]
-            ).execute()
+                id=message_id
+            ))
+        except Exception as e:
+            # One unreadable message must not abort the whole fetch
+            print(f"Error fetching Gmail message {message_id}, skipping: {e}")
+            return None
+
+    # Total size is known up front, so fill a preallocated buffer by index
+    all_emails = [None] * len(message_ids)
+
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        for i, msg in enumerate(executor.map(fetch_message, message_ids)):
+            if msg is None:
+                continue
+            # Index headers once (first occurrence wins) instead of rescanning per field
+            header_map = {}
+            for h in msg.get("payload", {}).get("headers", []):
+                header_map.setdefault(h["name"], h["value"])
 
-            headers = msg.get("payload", {}).get("headers", [])
             def get_header(name):
-                return next((h["value"] for h in headers if h["name"] == name), "")
+                return header_map.get(name, "")
 
             # Parse Gmail Date safely
-            raw_date = get_header("Date")
-            try:
-                dt = parsedate_to_datetime(raw_date)
-                iso_date = dt.isoformat()
-            except Exception:
-                iso_date = None
+            iso_date = parse_email_date(get_header("Date"))
 
             email_id = msg.get("id")
             
-            all_emails.append({
+            all_emails[i] = {
                 "id": email_id,
                 "thread_id": msg.get("threadId"),
                 "snippet": msg.get("snippet", ""),
@@ -72,17 +192,15 @@ async def fetch_gmail_messages(credentials, query="(category:primary OR label:se
                 "cc": get_header("Cc"),
                 "bcc": get_header("Bcc"),
                 "date": iso_date,  # <-- FIXED
-            })
+            }
             
             # Extract attachments
             attachments = extract_attachments(msg, email_id)
             all_attachments.extend(attachments)
 
-        next_page_token = response.get("nextPageToken")
-        if not next_page_token:
-            break
-
-        time.sleep(sleep_time)
+    # Drop the slots of messages that could not be fetched
+    if None in all_emails:
+        all_emails = [email for email in all_emails if email is not None]
 
     return all_emails, all_attachments
 
@@ -120,58 +238,144 @@ def extract_attachments(message, email_id):
 
 
 # ======================================================
-# Calendar: Fetch ALL future events (max 2500)
+# Calendar: Fetch events from two weeks ago onward (paginated)
 # ======================================================
 
-def fetch_calendar_events(credentials, max_results=2500):
-    service = build("calendar", "v3", credentials=credentials)
-    
-    now_dt = datetime.now(timezone.utc)
-    two_weeks_ago_dt = now_dt - timedelta(days=14)
+# Calendar's per-request cap for events.list
+CALENDAR_PAGE_SIZE = 2500
 
-    now = now_dt.isoformat().replace("+00:00", "Z")
-    two_weeks_ago = two_weeks_ago_dt.isoformat().replace("+00:00", "Z")
+# Partial response mask: only the event fields we store
+CALENDAR_LIST_FIELDS = "nextPageToken, items(id, summary, description, location, start, end, creator/email, organizer/email, htmlLink, updated)"
 
-    resp = service.events().list(
-        calendarId="primary",
-        timeMin=two_weeks_ago,
-        maxResults=max_results,
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
 
-    items = resp.get("items", [])
+def fetch_calendar_events(credentials, max_results=2500):
+    """
+    Fetch calendar events starting two weeks ago.
 
-    events = []
-    for e in items:
-        events.append({
-            "id": e.get("id"),
-            "summary": e.get("summary"),
-            "description": e.get("description"),
-            "location": e.get("location"),
-            "start": e.get("start"),
-            "end": e.get("end"),
+    Args:
+        credentials: Google OAuth credentials
+        max_results: Cap on the number of events. There is no timeMax, so an
+            open-ended recurring series would otherwise expand without limit
+    """
+    service = get_google_service("calendar", "v3", credentials)
+    
+    two_weeks_ago_dt = datetime.now(timezone.utc) - timedelta(days=14)
+    two_weeks_ago = two_weeks_ago_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-            # new metadata
-            "creator_email": e.get("creator", {}).get("email"),
-            "organizer_email": e.get("organizer", {}).get("email"),
-            "html_link": e.get("htmlLink"),
-            "updated": e.get("updated"),
-        })
+    items = []
+    page_token = None
+    while len(items) < max_results:
+        page_size = min(CALENDAR_PAGE_SIZE, max_results - len(items))
+        request = service.events().list(
+            calendarId="primary",
+            timeMin=two_weeks_ago,
+            maxResults=page_size,
+            singleEvents=True,
+            orderBy="startTime",
+            fields=CALENDAR_LIST_FIELDS,
+            pageToken=page_token
+        )
+        resp = execute_request(request)
 
-    return events
+        items.extend(resp.get("items", []))
+
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+
+    # The field mask already trims events to what insert_schedules reads
+    return items
 
 
 # ======================================================
 # Drive: BFS recursive traversal (+path +parents)
 # ======================================================
 
-def list_folder_children(service, folder_id):
-    result = service.files().list(
+# Drive accepts up to 100 sub-requests per batch HTTP call
+DRIVE_BATCH_SIZE = 100
+# Maximum page size files.list allows (default is 100)
+DRIVE_PAGE_SIZE = 1000
+
+# Partial response masks: request exactly the fields we store
+DRIVE_LIST_FIELDS = (
+    "nextPageToken, "
+    "files(id, name, mimeType, size, modifiedTime, parents, "
+    "owners(displayName, emailAddress), ownedByMe, sharingUser(displayName, emailAddress), "
+    "webViewLink, iconLink, thumbnailLink, createdTime, modifiedByMeTime, viewedByMe, viewedByMeTime)"
+)
+
+
+# Raw Drive fields kept verbatim in files.metadata
+DRIVE_METADATA_KEYS = (
+    "ownedByMe", "owners", "sharingUser", "mimeType", "webViewLink", "iconLink",
+    "thumbnailLink", "createdTime", "modifiedByMeTime", "viewedByMe", "viewedByMeTime",
+)
+
+
+def _folder_children_request(service, folder_id, page_token=None):
+    return service.files().list(
         q=f"'{folder_id}' in parents and trashed = false",
-        fields="files(id, name, mimeType, size, modifiedTime, parents, owners(displayName, emailAddress), ownedByMe, sharingUser(displayName, emailAddress))"
-    ).execute()
-    return result.get("files", [])
+        fields=DRIVE_LIST_FIELDS,
+        pageSize=DRIVE_PAGE_SIZE,
+        pageToken=page_token
+    )
+
+
+def list_folder_children(service, folder_id, page_token=None, limiter=None):
+    """List all children of a folder, following pagination from page_token onward"""
+    items = []
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        result = execute_request(_folder_children_request(service, folder_id, page_token))
+        items.extend(result.get("files", []))
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return items
+
+
+@with_retry(retries=3, base=1.0, label="Drive batch request")
+def _execute_folder_batch(service, folder_ids, responses):
+    """Send one batch of files.list calls; a fresh batch is built per attempt"""
+    def collect(request_id, response, exception):
+        if exception is None:
+            responses[int(request_id)] = response
+
+    batch = service.new_batch_http_request(callback=collect)
+    for idx, folder_id in enumerate(folder_ids):
+        batch.add(_folder_children_request(service, folder_id), request_id=str(idx))
+    batch.execute()
+
+
+def list_folders_children_batch(service, folder_ids, limiter=None):
+    """
+    List the children of several folders in a single batch HTTP round trip.
+    Sub-requests that fail inside the batch are retried individually, and
+    folders with more than one page continue with regular paginated requests.
+    Every sub-request takes a token from limiter (Drive counts them one by one).
+
+    Returns:
+        List of child lists, in the same order as folder_ids
+    """
+    responses = [None] * len(folder_ids)
+
+    if limiter is not None:
+        limiter.acquire(len(folder_ids))
+    _execute_folder_batch(service, folder_ids, responses)
+
+    children = []
+    for folder_id, response in zip(folder_ids, responses):
+        if response is None:
+            children.append(list_folder_children(service, folder_id, limiter=limiter))
+            continue
+
+        files = response.get("files", [])
+        next_page_token = response.get("nextPageToken")
+        if next_page_token:
+            files.extend(list_folder_children(service, folder_id, page_token=next_page_token, limiter=limiter))
+        children.append(files)
+
+    return children
 
 
 def fetch_drive_all_files(credentials, debug_mode=False):
@@ -187,88 +391,100 @@ def fetch_drive_all_files(credentials, debug_mode=False):
         id, name, mime_type, size, modified_time, path, parents
     }
     """
-    service = build("drive", "v3", credentials=credentials)
+    # Drive quota is per user, so each traversal gets its own bucket; it holds
+    # a full batch so one batch can always be admitted
+    limiter = TokenBucket(DRIVE_REQUESTS_PER_SECOND, capacity=max(DRIVE_REQUESTS_PER_SECOND, DRIVE_BATCH_SIZE))
+
+    def list_children_batch(folders):
+        worker_service = get_google_service("drive", "v3", credentials)
+        return list_folders_children_batch(worker_service, [folder_id for folder_id, _ in folders], limiter)
 
     root_id = "root"
-    queue = [(root_id, "/")]
+    frontier = [(root_id, "/")]
     results = []
 
-    while queue:
-        parent_id, parent_path = queue.pop(0)
-        children = list_folder_children(service, parent_id)
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        while frontier:
+            next_frontier = []
 
-        for f in children:
-            name = f["name"]
-            mime_type = f.get("mimeType", "")
-            is_folder = mime_type == "application/vnd.google-apps.folder"
+            # List every folder on this level, batched and run concurrently; map() keeps BFS order
+            chunks = [frontier[i:i + DRIVE_BATCH_SIZE] for i in range(0, len(frontier), DRIVE_BATCH_SIZE)]
+            level_children = [
+                children
+                for chunk_children in executor.map(list_children_batch, chunks)
+                for children in chunk_children
+            ]
 
-            # Build path
-            current_path = (
-                parent_path.rstrip("/") + "/" + name
-                if parent_path != "/"
-                else "/" + name
-            )
-            
-            # Extract owner information
-            # Debug: Log the raw API response for first few files
-            if len(results) < 3:
-                print(f"[DEBUG] File: {name}")
-                print(f"[DEBUG] ownedByMe: {f.get('ownedByMe')}")
-                print(f"[DEBUG] owners: {f.get('owners')}")
-                print(f"[DEBUG] sharingUser: {f.get('sharingUser')}")
-            
-            owners = f.get("owners", [])
-            owner_emails = ", ".join([o.get("emailAddress", "") for o in owners if o.get("emailAddress")])
-            owner_names = ", ".join([o.get("displayName", "") for o in owners if o.get("displayName")])
-            
-            # If file is not owned by user, try to get sharing user info
-            if not f.get("ownedByMe", True) and f.get("sharingUser"):
-                sharing_user = f.get("sharingUser", {})
-                sharing_email = sharing_user.get("emailAddress", "")
-                sharing_name = sharing_user.get("displayName", "")
-                if sharing_email:
-                    owner_emails = sharing_email
-                    owner_names = sharing_name
-            
-            # Collect metadata for richer information storage
-            metadata = {
-                "ownedByMe": f.get("ownedByMe"),
-                "owners": f.get("owners", []),
-                "sharingUser": f.get("sharingUser"),
-                "mimeType": f.get("mimeType"),
-                "webViewLink": f.get("webViewLink"),
-                "iconLink": f.get("iconLink"),
-                "thumbnailLink": f.get("thumbnailLink"),
-                "createdTime": f.get("createdTime"),
-                "modifiedByMeTime": f.get("modifiedByMeTime"),
-                "viewedByMe": f.get("viewedByMe"),
-                "viewedByMeTime": f.get("viewedByMeTime"),
-            }
+            for (parent_id, parent_path), children in zip(frontier, level_children):
+                for f in children:
+                    name = f["name"]
+                    mime_type = f.get("mimeType", "")
+                    is_folder = mime_type == "application/vnd.google-apps.folder"
 
-            results.append({
-                "id": f["id"],
-                "name": name,
-                "mime_type": mime_type,
-                "size": f.get("size"),
-                "modified_time": f.get("modifiedTime"),
-                "path": current_path,
-                "parents": f.get("parents", []),
-                "owner_email": owner_emails,
-                "owner_name": owner_names,
-                "metadata": metadata,
-            })
+                    # Build path
+                    current_path = (
+                        parent_path.rstrip("/") + "/" + name
+                        if parent_path != "/"
+                        else "/" + name
+                    )
+                    
+                    # Extract owner information
+                    # Debug: Log the raw API response for first few files
+                    if len(results) < 3:
+                        print(f"[DEBUG] File: {name}")
+                        print(f"[DEBUG] ownedByMe: {f.get('ownedByMe')}")
+                        print(f"[DEBUG] owners: {f.get('owners')}")
+                        print(f"[DEBUG] sharingUser: {f.get('sharingUser')}")
+                    
+                    owners = f.get("owners", [])
+                    emails = []
+                    names = []
+                    for o in owners:
+                        email = o.get("emailAddress")
+                        if email:
+                            emails.append(email)
+                        display_name = o.get("displayName")
+                        if display_name:
+                            names.append(display_name)
+                    owner_emails = ", ".join(emails)
+                    owner_names = ", ".join(names)
+                    
+                    # If file is not owned by user, try to get sharing user info
+                    if not f.get("ownedByMe", True) and f.get("sharingUser"):
+                        sharing_user = f.get("sharingUser", {})
+                        sharing_email = sharing_user.get("emailAddress", "")
+                        sharing_name = sharing_user.get("displayName", "")
+                        if sharing_email:
+                            owner_emails = sharing_email
+                            owner_names = sharing_name
+                    
+                    # Collect metadata for richer information storage
+                    metadata = {key: f.get(key) for key in DRIVE_METADATA_KEYS}
+                    metadata["owners"] = owners
 
-            if is_folder:
-                queue.append((f["id"], current_path))
+                    results.append({
+                        "id": f["id"],
+                        "name": name,
+                        "mime_type": mime_type,
+                        "size": f.get("size"),
+                        "modified_time": f.get("modifiedTime"),
+                        "path": current_path,
+                        "parents": f.get("parents", []),
+                        "owner_email": owner_emails,
+                        "owner_name": owner_names,
+                        "metadata": metadata,
+                    })
 
-        time.sleep(0.2)
+                    if is_folder:
+                        next_frontier.append((f["id"], current_path))
+
+            frontier = next_frontier
     
     # DEBUG mode: Sort by modified_time and limit to 50 most recent files
     if debug_mode:
-        # Filter out folders and sort by modified_time (most recent first)
-        files_only = [f for f in results if f["mime_type"] != "application/vnd.google-apps.folder"]
-        files_only.sort(key=lambda x: x.get("modified_time", ""), reverse=True)
-        results = files_only[:50]
+        # Filter out folders and keep the most recently modified (no full sort needed)
+        files_only = (f for f in results if f["mime_type"] != "application/vnd.google-apps.folder")
+        results = heapq.nlargest(50, files_only, key=lambda x: x.get("modified_time") or "")
         print(f"[DEBUG MODE] Limited to {len(results)} most recent files")
 
     return results
@@ -278,49 +494,57 @@ def fetch_drive_all_files(credentials, debug_mode=False):
 # File Processing and Download
 # ======================================================
 
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+DRIVE_DOWNLOAD_TIMEOUT = (10, 600)  # (connect, read) seconds
+DRIVE_DOWNLOAD_CHUNK_BYTES = 1 << 20
+
+# Google Workspace files have no binary content and must be exported
+GOOGLE_WORKSPACE_EXPORT_TYPES = {
+    'application/vnd.google-apps.document': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',  # Export as DOCX
+    'application/vnd.google-apps.spreadsheet': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',  # Export as XLSX
+    'application/vnd.google-apps.presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',  # Export as PPTX
+    'application/vnd.google-apps.drawing': 'application/pdf',  # Export as PDF
+}
+
+
+@with_retry(retries=3, base=1.0, label="Drive media download")
+def stream_drive_media(credentials, url, params):
+    """Stream a Drive media URL over the thread's pooled, authorized connection"""
+    session = get_authorized_session(credentials)
+    with session.get(url, params=params, stream=True, timeout=DRIVE_DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        file_content = io.BytesIO()
+        for chunk in response.iter_content(DRIVE_DOWNLOAD_CHUNK_BYTES):
+            file_content.write(chunk)
+    
+    # getvalue() hands back the buffer without a second full-size copy
+    return file_content.getvalue()
+
+
 def download_file_content(credentials, file_id, mime_type=None):
     """Download or export file content from Google Drive"""
     try:
-        service = build("drive", "v3", credentials=credentials)
-        
-        # Check if it's a Google Workspace file that needs export
-        google_workspace_types = {
-            'application/vnd.google-apps.document': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',  # Export as DOCX
-            'application/vnd.google-apps.spreadsheet': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',  # Export as XLSX
-            'application/vnd.google-apps.presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',  # Export as PPTX
-            'application/vnd.google-apps.drawing': 'application/pdf',  # Export as PDF
-        }
-        
         print(f"[DEBUG] Downloading file {file_id}, mime_type: {mime_type}")
         
         # If mime_type not provided or it's a workspace file, check via API
-        if not mime_type or mime_type in google_workspace_types:
+        if not mime_type or mime_type in GOOGLE_WORKSPACE_EXPORT_TYPES:
             # Get file metadata to determine if export is needed
+            service = get_google_service("drive", "v3", credentials)
             file_metadata = service.files().get(fileId=file_id, fields='mimeType').execute()
-            actual_mime_type = file_metadata.get('mimeType')
-            print(f"[DEBUG] Actual mime_type from API: {actual_mime_type}")
-            
-            if actual_mime_type in google_workspace_types:
-                export_mime_type = google_workspace_types[actual_mime_type]
-                print(f"[DEBUG] Using export with mime_type: {export_mime_type}")
-                request = service.files().export_media(fileId=file_id, mimeType=export_mime_type)
-            else:
-                print(f"[DEBUG] Using regular download")
-                request = service.files().get_media(fileId=file_id)
-        else:
-            # Regular binary file - use download
-            print(f"[DEBUG] Using regular download (non-workspace file)")
-            request = service.files().get_media(fileId=file_id)
+            mime_type = file_metadata.get('mimeType')
+            print(f"[DEBUG] Actual mime_type from API: {mime_type}")
         
-        file_content = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_content, request)
-        
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
+        if mime_type in GOOGLE_WORKSPACE_EXPORT_TYPES:
+            export_mime_type = GOOGLE_WORKSPACE_EXPORT_TYPES[mime_type]
+            print(f"[DEBUG] Using export with mime_type: {export_mime_type}")
+            url = f"{DRIVE_FILES_URL}/{file_id}/export"
+            params = {"mimeType": export_mime_type, "alt": "media"}
+        else:
+            print(f"[DEBUG] Using regular download")
+            url = f"{DRIVE_FILES_URL}/{file_id}"
+            params = {"alt": "media"}
         
-        file_content.seek(0)
-        return file_content.read()
+        return stream_drive_media(credentials, url, params)
     except Exception as e:
         print(f"Error downloading file {file_id}: {e}")
         return None
@@ -329,21 +553,58 @@ def download_file_content(credentials, file_id, mime_type=None):
 def download_attachment_content(credentials, message_id, attachment_id):
     """Download attachment content from Gmail"""
     try:
-        service = build("gmail", "v1", credentials=credentials)
+        service = get_google_service("gmail", "v1", credentials)
         attachment = service.users().messages().attachments().get(
             userId="me",
             messageId=message_id,
             id=attachment_id
         ).execute()
         
-        import base64
-        file_data = base64.urlsafe_b64decode(attachment['data'])
+        file_data = base64.b64decode(attachment['data'].encode('ascii').translate(_URLSAFE_TRANS))
         return file_data
     except Exception as e:
         print(f"Error downloading attachment {attachment_id}: {e}")
         return None
 
 
+# Document parsing (PyMuPDF, python-docx, openpyxl...) is CPU-bound and holds
+# the GIL, so the download threads would take turns; it runs in worker
+# processes instead. 0 parses in the calling thread.
+DOC_EXTRACT_WORKERS = int(os.getenv("DOC_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+_extract_executor = None
+_extract_executor_lock = threading.Lock()
+
+
+def get_extract_executor():
+    """Process pool for document text extraction, started on first use."""
+    global _extract_executor
+    if _extract_executor is None:
+        with _extract_executor_lock:
+            if _extract_executor is None:
+                # spawn: forking a process with live request threads can
+                # copy locks that are held and never released
+                _extract_executor = ProcessPoolExecutor(
+                    max_workers=DOC_EXTRACT_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _extract_executor
+
+
+def extract_document_text(file_content: bytes, file_name: str) -> str:
+    """extractDOC in the extraction process pool (in-thread if disabled or the pool broke)."""
+    global _extract_executor
+    if DOC_EXTRACT_WORKERS > 0:
+        executor = get_extract_executor()
+        try:
+            return executor.submit(extractDOC, file_content, file_name).result()
+        except BrokenProcessPool as e:
+            print(f"[EXTRACT] Worker pool broke ({e}); parsing {file_name} in-thread")
+            with _extract_executor_lock:
+                if _extract_executor is executor:
+                    _extract_executor = None
+    return extractDOC(file_content, filename=file_name)
+
+
 def process_file_by_type(file_name: str, file_content: bytes) -> str:
     """
     Process file content and return summary.
@@ -363,7 +624,7 @@ def process_file_by_type(file_name: str, file_content: bytes) -> str:
             return "An image file with no extractable text."
     if isDOC(file_name):
         try:
-            text = extractDOC(file_content, filename=file_name)
+            text = extract_document_text(file_content, file_name)
             return summarize_doc(text, filename=file_name)
         except Exception as e:
             return "A document file with no extractable text."
@@ -399,13 +660,65 @@ def create_email_embeddings(user_id: str, emails: list, start_progress: int, end
     processed_count = [0]
     last_update_progress = [start_progress]
     
+    # Every attachment of the user, fetched once and grouped by email
+    attachments_by_email = build_attachments_index(user_id)
+    # Thread messages for all emails, fetched in a few batched requests
+    emails_by_thread = get_emails_by_threads(
+        user_id,
+        (email["thread_id"] for email in emails if email.get("thread_id")),
+        columns="id, thread_id, from_user, date, subject, body",
+    )
+    
+    def build_thread_text(thread_id):
+        """Thread context text, summarized when it is too long"""
+        lines = ["Email thread:\n"]
+        for t_email in emails_by_thread.get(thread_id, []):
+            # Get attachments for thread email
+            t_attachments = attachments_by_email.get(t_email["id"])
+            t_att_info = ""
+            if t_attachments:
+                t_att_info = " [Attachments: " + ", ".join([att.get('filename', 'unknown') for att in t_attachments]) + "]"
+            
+            lines.append(
+                f"From {t_email.get('from_user', 'unknown')} "
+                f"at {t_email.get('date', 'unknown')}: "
+                f"{t_email.get('subject', 'No subject')} - "
+                f"{t_email.get('body', '')}"
+                f"{t_att_info}\n"
+            )
+        thread_text = "".join(lines)
+        
+        # Summarize thread if it's too long (> 8000 chars)
+        if len(thread_text) > 8000:
+            print(f"[INFO] Thread {thread_id} is long ({len(thread_text)} chars), summarizing...")
+            thread_summary = summarize(thread_text, max_chars=8000)
+            thread_text = f"Email thread summary:\n{thread_summary}"
+        return thread_text
+    
+    # Each thread's text is built (and summarized) once, by whichever worker
+    # reaches it first; the others wait for that result
+    thread_texts = {}
+    
+    def get_thread_text(thread_id):
+        with progress_lock:
+            future = thread_texts.get(thread_id)
+            owner = future is None
+            if owner:
+                future = thread_texts[thread_id] = Future()
+        if owner:
+            try:
+                future.set_result(build_thread_text(thread_id))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+    
     def process_single_email(email):
         """Process a single email and return embeddings"""
         email_id = email["id"]
         email_embeddings = []
         
         # Get attachments for this email
-        attachments = get_attachments_by_email(user_id, email_id)
+        attachments = attachments_by_email.get(email_id)
         attachment_info = ""
         if attachments:
             attachment_info = "\nAttachments:\n"
@@ -422,86 +735,52 @@ def create_email_embeddings(user_id: str, emails: list, start_progress: int, end
             f"Content: {email.get('body', '')}"
             f"{attachment_info}"
         )
-        try:
-            email_sum_vector = embed_text(email_sum_text)
-            email_embeddings.append({
-                "id": f"{email_id}_sum",
-                "user_id": user_id,
-                "type": "email_sum",
-                "vector": email_sum_vector,
-                "email_id": email_id,
-                "schedule_id": None,
-                "file_id": None,
-                "attachment_id": None
-            })
-        except Exception as e:
-            print(f"Error embedding email_sum for {email_id}: {e}")
+        texts = {"email_sum": email_sum_text}
         
-        # 2. email_context: Full thread context with summarization
+        # 2. email_context: Full thread context (shared by every email in the thread)
         thread_id = email.get("thread_id")
         if thread_id:
             try:
-                thread_emails = get_emails_by_thread(user_id, thread_id)
-                thread_text = "Email thread:\n"
-                for t_email in thread_emails:
-                    # Get attachments for thread email
-                    t_attachments = get_attachments_by_email(user_id, t_email["id"])
-                    t_att_info = ""
-                    if t_attachments:
-                        t_att_info = " [Attachments: "
-                        t_att_info += ", ".join([att.get('filename', 'unknown') for att in t_attachments])
-                        t_att_info += "]"
-                    
-                    thread_text += (
-                        f"From {t_email.get('from_user', 'unknown')} "
-                        f"at {t_email.get('date', 'unknown')}: "
-                        f"{t_email.get('subject', 'No subject')} - "
-                        f"{t_email.get('body', '')}"
-                        f"{t_att_info}\n"
-                    )
-                
-                # Summarize thread if it's too long (> 8000 chars)
-                if len(thread_text) > 8000:
-                    print(f"[INFO] Thread {thread_id} is long ({len(thread_text)} chars), summarizing...")
-                    thread_summary = summarize(thread_text, max_chars=8000)
-                    thread_text = f"Email thread summary:\n{thread_summary}"
-                
-                email_context_vector = embed_text(thread_text)
-                email_embeddings.append({
-                    "id": f"{email_id}_context",
-                    "user_id": user_id,
-                    "type": "email_context",
-                    "vector": email_context_vector,
-                    "email_id": email_id,
-                    "schedule_id": None,
-                    "file_id": None,
-                    "attachment_id": None
-                })
+                texts["email_context"] = get_thread_text(thread_id)
             except Exception as e:
-                print(f"Error embedding email_context for {email_id}: {e}")
+                print(f"Error building email_context for {email_id}: {e}")
         
         # 3. email_title: Subject and sender/receiver info only (no attachments)
-        email_title_text = (
+        texts["email_title"] = (
             f"An Email with subject: {email.get('subject', 'No subject')}. "
             f"From: {email.get('from_user', 'unknown')}. "
             f"To: {email.get('to_user', 'unknown')}. "
             f"CC: {email.get('cc', 'none')}. "
             f"BCC: {email.get('bcc', 'none')}."
         )
+        
+        # All of this email's texts go in one embedding request. A rejected
+        # batch is embedded one text at a time so a single bad text costs only
+        # its own vector; transient errors were already retried, so they propagate
         try:
-            email_title_vector = embed_text(email_title_text)
+            vectors = dict(zip(texts, embed_texts(list(texts.values()))))
+        except Exception as e:
+            if is_retryable_error(e):
+                raise
+            print(f"Error batch embedding email {email_id}, retrying per text: {e}")
+            vectors = {}
+            for embedding_type, text in texts.items():
+                try:
+                    vectors[embedding_type] = embed_text(text)
+                except Exception as e:
+                    print(f"Error embedding {embedding_type} for {email_id}: {e}")
+        
+        for embedding_type, vector in vectors.items():
             email_embeddings.append({
-                "id": f"{email_id}_title",
+                "id": f"{email_id}_{embedding_type.split('_', 1)[1]}",
                 "user_id": user_id,
-                "type": "email_title",
-                "vector": email_title_vector,
+                "type": embedding_type,
+                "vector": vector,
                 "email_id": email_id,
                 "schedule_id": None,
                 "file_id": None,
                 "attachment_id": None
             })
-        except Exception as e:
-            print(f"Error embedding email_title for {email_id}: {e}")
         
         # Update progress (thread-safe)
         with progress_lock:
@@ -621,6 +900,8 @@ def create_file_embeddings(user_id: str, files: list, credentials, start_progres
     progress_lock = threading.Lock()
     processed_count = [0]
     last_update_progress = [start_progress]
+    # Summaries are written in one request after the parallel phase
+    file_summaries = {}
     
     def process_single_file(file):
         """Process a single file and return embedding"""
@@ -635,8 +916,8 @@ def create_file_embeddings(user_id: str, files: list, credentials, start_progres
                 # Process file to get summary
                 summary = process_file_by_type(file_name, file_content)
                 
-                # Update file summary in database
-                update_file_summary(user_id, file_id, summary)
+                with progress_lock:
+                    file_summaries[file_id] = summary
                 
                 # Create embedding with file metadata and summary
                 metadata = file.get('metadata', {})
@@ -684,6 +965,9 @@ def create_file_embeddings(user_id: str, files: list, credentials, start_progres
     thread_pool = get_thread_pool_manager()
     results = thread_pool.process_parallel(user_id, files, process_single_file)
     
+    if file_summaries:
+        update_file_summaries(user_id, file_summaries)
+    
     # Filter out None results and batch insert
     embeddings_to_insert = [r for r in results if r is not None]
     if embeddings_to_insert:
@@ -712,6 +996,8 @@ def create_attachment_embeddings(user_id: str, attachments: list, credentials, s
     progress_lock = threading.Lock()
     processed_count = [0]
     last_update_progress = [start_progress]
+    # Summaries are written in one request after the parallel phase
+    attachment_summaries = []
     
     def process_single_attachment(attachment):
         """Process a single attachment and return embedding"""
@@ -736,8 +1022,8 @@ def create_attachment_embeddings(user_id: str, attachments: list, credentials, s
                 # Process attachment to get summary
                 summary = process_file_by_type(filename, att_content)
                 
-                # Update attachment summary in database
-                update_attachment_summary(user_id, attachment_id, summary)
+                with progress_lock:
+                    attachment_summaries.append({"id": attachment_id, "email_id": email_id, "summary": summary})
                 
                 # Create embedding with attachment metadata, email context, and summary
                 att_text = f"Email attachment:\nFilename: {filename}\n"
@@ -787,6 +1073,9 @@ def create_attachment_embeddings(user_id: str, attachments: list, credentials, s
     thread_pool = get_thread_pool_manager()
     results = thread_pool.process_parallel(user_id, attachments, process_single_attachment)
     
+    if attachment_summaries:
+        update_attachment_summaries(user_id, attachment_summaries)
+    
     # Filter out None results and batch insert
     embeddings_to_insert = [r for r in results if r is not None]
     if embeddings_to_insert:
@@ -1,10 +1,17 @@
 # openai_api_utils.py
 import os
+import time
+import asyncio
+import hashlib
+import threading
+import orjson
+from collections import OrderedDict
 from typing import List
 from dotenv import load_dotenv
 from openai import OpenAI, AsyncOpenAI
 from retrieval_service.agent import SEARCH_TOOLS
 from retrieval_service.search_utils import execute_search_tool
+from retrieval_service.rate_limit_utils import openai_limiter, openai_semaphore, get_openai_async_semaphore
 import json
 
 # Load API key from .env file
@@ -18,6 +25,90 @@ if not OPENAI_API_KEY:
 client = OpenAI(api_key=OPENAI_API_KEY)
 async_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
+# Content-addressed cache for deterministic completions (temperature at most
+# CACHEABLE_TEMPERATURE); sampled answers are never reused.
+# Structure: {sha256(model, messages, temperature): (expires_at, text)}
+COMPLETION_CACHE_TTL = int(os.getenv("COMPLETION_CACHE_TTL", "3600"))
+COMPLETION_CACHE_MAX_ENTRIES = 1024
+CACHEABLE_TEMPERATURE = 0.01
+_completion_cache: OrderedDict = OrderedDict()
+_completion_cache_lock = threading.Lock()
+
+
+def _completion_cache_key(model: str, messages: list, temperature, cache: bool):
+    """Cache key for a request, or None when its answer must not be reused"""
+    if not cache or temperature is None or temperature > CACHEABLE_TEMPERATURE:
+        return None
+    payload = json.dumps([model, messages, float(temperature)], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _get_cached_completion(key: str):
+    with _completion_cache_lock:
+        entry = _completion_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del _completion_cache[key]
+            return None
+        _completion_cache.move_to_end(key)
+        return entry[1]
+
+
+def _set_cached_completion(key: str, text: str):
+    with _completion_cache_lock:
+        _completion_cache[key] = (time.time() + COMPLETION_CACHE_TTL, text)
+        _completion_cache.move_to_end(key)
+        while len(_completion_cache) > COMPLETION_CACHE_MAX_ENTRIES:
+            _completion_cache.popitem(last=False)
+
+
+def complete(messages: list, model: str = "gpt-4o-mini", temperature: float = None, cache: bool = False) -> str:
+    """
+    Run a non-streaming chat completion and return the stripped text.
+
+    Args:
+        messages: Chat messages
+        model: Model to use
+        temperature: Sampling temperature (None uses the API default)
+        cache: Reuse an earlier answer for an identical request within COMPLETION_CACHE_TTL
+            (only honoured for deterministic requests, temperature <= CACHEABLE_TEMPERATURE)
+    """
+    key = _completion_cache_key(model, messages, temperature, cache)
+    if key:
+        cached = _get_cached_completion(key)
+        if cached is not None:
+            return cached
+
+    kwargs = {} if temperature is None else {"temperature": temperature}
+    with openai_semaphore:
+        openai_limiter.acquire()
+        response = client.chat.completions.create(model=model, messages=messages, **kwargs)
+    text = response.choices[0].message.content.strip()
+
+    if key:
+        _set_cached_completion(key, text)
+    return text
+
+
+async def complete_async(messages: list, model: str = "gpt-4o-mini", temperature: float = None, cache: bool = False) -> str:
+    """Async counterpart of complete()"""
+    key = _completion_cache_key(model, messages, temperature, cache)
+    if key:
+        cached = _get_cached_completion(key)
+        if cached is not None:
+            return cached
+
+    kwargs = {} if temperature is None else {"temperature": temperature}
+    async with get_openai_async_semaphore():
+        await openai_limiter.acquire_async()
+        response = await async_client.chat.completions.create(model=model, messages=messages, **kwargs)
+    text = response.choices[0].message.content.strip()
+
+    if key:
+        _set_cached_completion(key, text)
+    return text
+
 
 def summarize(text: str, max_chars: int = 8000) -> str:
     """
@@ -35,16 +126,16 @@ def summarize(text: str, max_chars: int = 8000) -> str:
 
     prompt = f"Please summarize the following content in a concise way (only first {max_chars} chars are shown):\n\n{text}"
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",   # Cheapest high-quality model
-        messages=[
+    return complete(
+        [
             {"role": "system", "content": "You are a concise summarization assistant."},
             {"role": "user", "content": prompt},
-        ]
+        ],
+        model="gpt-4o-mini",   # Cheapest high-quality model
+        temperature=0,
+        cache=True,
     )
 
-    return response.choices[0].message.content.strip()
-
 
 async def chat_stream(messages: list, model: str = "gpt-4o"):
     """
@@ -57,6 +148,7 @@ async def chat_stream(messages: list, model: str = "gpt-4o"):
     Yields:
         str: Token chunks as they arrive
     """
+    await openai_limiter.acquire_async()
     stream = await async_client.chat.completions.create(
         model=model,
         messages=messages,
@@ -121,16 +213,14 @@ def summarize_chunk(chunk: str, chunk_index: int, total_chunks: int) -> str:
     """
     prompt = f"Summarize this section (part {chunk_index + 1} of {total_chunks}):\n\n{chunk}"
     
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
+    return complete(
+        [
             {"role": "system", "content": "You are a summarization assistant. Provide concise summaries."},
             {"role": "user", "content": prompt},
         ],
-        temperature=0.3,
+        temperature=0,
+        cache=True,
     )
-    
-    return response.choices[0].message.content.strip()
 
 
 def combine_summaries(summaries: list[str], filename: str) -> str:
@@ -148,16 +238,14 @@ def combine_summaries(summaries: list[str], filename: str) -> str:
     
     prompt = f"Combine these section summaries of the file '{filename}' into one cohesive summary. Start with 'A(n) [file type] file...':\n\n{combined_text}"
     
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
+    return complete(
+        [
             {"role": "system", "content": "You are a summarization assistant. Create a unified summary from multiple parts."},
             {"role": "user", "content": prompt},
         ],
-        temperature=0.3,
+        temperature=0,
+        cache=True,
     )
-    
-    return response.choices[0].message.content.strip()
 
 
 def summarize_doc(text: str, filename: str, max_chars: int = 30000, chunk_size: int = 6000) -> str:
@@ -192,16 +280,14 @@ def summarize_doc(text: str, filename: str, max_chars: int = 30000, chunk_size:
     if len(text) <= chunk_size:
         prompt = f"Please summarize this file named '{filename}' concisely, starting with 'A(n) [file type] file...':\n\n{text}"
         
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
+        return complete(
+            [
                 {"role": "system", "content": "You are a concise summarization assistant."},
                 {"role": "user", "content": prompt},
             ],
-            temperature=0.3,
+            temperature=0,
+            cache=True,
         )
-        
-        return response.choices[0].message.content.strip()
     
     # Map-reduce approach for large texts
     print(f"[INFO] File {filename} is large ({len(text)} chars), using chunked summarization")
@@ -254,13 +340,11 @@ Latest question: {user_message}
 
 Standalone search query:"""
             
-            contextualization_response = await async_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": contextualization_prompt}],
+            search_query = await complete_async(
+                [{"role": "user", "content": contextualization_prompt}],
                 temperature=0.0,
+                cache=True,
             )
-            
-            search_query = contextualization_response.choices[0].message.content.strip()
             print(f"[RAG] Contextualized query: {user_message} -> {search_query}")
             
         except Exception as e:
@@ -274,7 +358,9 @@ Standalone search query:"""
     }
     
     try:
-        context, references, raw_results = combined_search(
+        # Blocking I/O (embedding retries, Supabase) runs off the event loop
+        context, references, raw_results = await asyncio.to_thread(
+            combined_search,
             user_id=user_id,
             query=search_query,
             top_k=5
@@ -304,6 +390,7 @@ Standalone search query:"""
     messages_copy.append({"role": "user", "content": rag_prompt})
     
     # Step 3: Stream response
+    await openai_limiter.acquire_async()
     stream = await async_client.chat.completions.create(
         model="gpt-4o",
         messages=messages_copy,
@@ -333,7 +420,11 @@ async def react_with_tools_stream(messages, user_id: str, max_iterations: int =
     """
     Persistent ReAct loop that keeps trying until it gets results or reaches max iterations.
     """
-    all_references = []
+    # References across all tool calls, one per (type, id) in first-seen order;
+    # searches in later iterations often return the same items again
+    all_references = {}
+    # Rows already hydrated during this run, reused when searches overlap
+    row_cache = {}
     iteration = 0
     
     while iteration < max_iterations:
@@ -341,12 +432,14 @@ async def react_with_tools_stream(messages, user_id: str, max_iterations: int =
         print(f"[AGENT] ReAct iteration {iteration}/{max_iterations}")
         
         # ---------- Step: Call model with tools ----------
-        response = await async_client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            tools=SEARCH_TOOLS,
-            tool_choice="auto",
-        )
+        async with get_openai_async_semaphore():
+            await openai_limiter.acquire_async()
+            response = await async_client.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                tools=SEARCH_TOOLS,
+                tool_choice="auto",
+            )
 
         assistant_msg = response.choices[0].message
         tool_calls = assistant_msg.tool_calls or []
@@ -360,10 +453,12 @@ async def react_with_tools_stream(messages, user_id: str, max_iterations: int =
         # ---------- Execute tool calls ----------
         messages.append(assistant_msg)
         
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            arguments = json.loads(tool_call.function.arguments or "{}")
+        parsed_calls = [
+            (tool_call, tool_call.function.name, orjson.loads(tool_call.function.arguments or "{}"))
+            for tool_call in tool_calls
+        ]
 
+        for tool_call, function_name, arguments in parsed_calls:
             # Send tool call start event
             yield {
                 "type": "tool_call_start",
@@ -372,19 +467,24 @@ async def react_with_tools_stream(messages, user_id: str, max_iterations: int =
                 "search_types": arguments.get('search_types', [])
             }
 
-            # Real tool execution
-            tool_output = await execute_search_tool(function_name, arguments, user_id)
+        # Real tool execution; calls in one turn are independent, so run them concurrently
+        tool_outputs = await asyncio.gather(*(
+            execute_search_tool(function_name, arguments, user_id, row_cache)
+            for _, function_name, arguments in parsed_calls
+        ))
 
+        for (tool_call, function_name, _), tool_output in zip(parsed_calls, tool_outputs):
             # Collect references
             if tool_output.get("references"):
-                all_references.extend(tool_output["references"])
+                for reference in tool_output["references"]:
+                    all_references.setdefault((reference["type"], reference["id"]), reference)
 
             # Send tool result back to model
             messages.append({
                 "role": "tool",
                 "tool_call_id": tool_call.id,
                 "name": function_name,
-                "content": json.dumps(tool_output, ensure_ascii=False),
+                "content": orjson.dumps(tool_output).decode(),
             })
 
             # Send tool call end event
@@ -398,6 +498,7 @@ async def react_with_tools_stream(messages, user_id: str, max_iterations: int =
         # Loop continues - model can decide to call more tools or respond
 
     # ---------- Final: Stream the response ----------
+    await openai_limiter.acquire_async()
     stream = await async_client.chat.completions.create(
         model="gpt-4o",
         messages=messages,
@@ -415,7 +516,7 @@ async def react_with_tools_stream(messages, user_id: str, max_iterations: int =
     if all_references:
         yield {
             "type": "references",
-            "references": all_references
+            "references": list(all_references.values())
         }
 
     yield {"type": "done"}
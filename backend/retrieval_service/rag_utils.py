@@ -1,3 +1,11 @@
+import os
+import re
+import time
+import heapq
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from operator import itemgetter
 from typing import Dict, List, Tuple
 from retrieval_service.search_utils import (
     vector_search,
@@ -6,21 +14,94 @@ from retrieval_service.search_utils import (
     get_context_from_results,
     DEFAULT_TOP_K
 )
-from retrieval_service.gemni_api_utils import embed_text
+from retrieval_service.gemni_api_utils import embed_query
 
+# Per-search progress lines are only built and printed when RAG_TRACE=true;
+# errors are always printed
+RAG_TRACE = os.getenv("RAG_TRACE", "false").lower() == "true"
 
-def deduplicate_results(results: List[Dict]) -> List[Dict]:
+# Shared pool for the search branches; they are network/DB bound, so threads overlap fine
+RAG_SEARCH_WORKERS = int(os.getenv("RAG_SEARCH_WORKERS", "12"))
+_search_executor = ThreadPoolExecutor(max_workers=RAG_SEARCH_WORKERS, thread_name_prefix="rag-search")
+
+# Semantic (cosine) score above which a hit counts as confident enough to stop
+# waiting for the other branches; 0 disables the early exit
+RAG_EARLY_EXIT_SCORE = float(os.getenv("RAG_EARLY_EXIT_SCORE", "0.85"))
+
+# Short-lived cache of combined_search output, so retries and repeated
+# questions skip the search round trips; kept short so new data shows up quickly
+RAG_RESULT_CACHE_TTL = int(os.getenv("RAG_RESULT_CACHE_TTL", "60"))
+RAG_RESULT_CACHE_MAX_ENTRIES = 256
+_result_cache: OrderedDict = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+
+# Keyword extraction: word tokens of 3+ characters, minus common English stopwords
+_KEYWORD_RE = re.compile(r"[\w']{3,}")
+_WORD_RE = re.compile(r"\w")
+KEYWORD_STOPWORDS = frozenset({
+    "the", "and", "for", "are", "but", "not", "you", "your", "all", "any", "can",
+    "had", "has", "have", "her", "his", "him", "its", "our", "out", "was", "were",
+    "what", "when", "where", "which", "who", "whom", "why", "how", "with", "from",
+    "that", "this", "these", "those", "there", "their", "them", "they", "then",
+    "than", "into", "about", "did", "does", "doing", "been", "being", "will",
+    "would", "could", "should", "shall", "may", "might", "must", "just", "also",
+    "some", "such", "only", "own", "same", "too", "very", "more", "most", "other",
+    "over", "under", "again", "once", "here", "each", "few", "both", "she",
+    "tell", "show", "find", "give", "get", "please", "know", "let",
+})
+
+
+def extract_keywords(query: str) -> List[str]:
     """
-    Deduplicate search results based on type and id.
-    Keeps the result with the highest score for each unique (type, id) pair.
+    Split a query into distinct lowercase keywords for keyword_search.
+    Punctuation is dropped, stopwords removed and repeats collapsed (first
+    occurrence order kept), since keyword_search runs queries per keyword.
+    """
+    tokens = (word.lower() for word in _KEYWORD_RE.findall(query))
+    return list(dict.fromkeys(word for word in tokens if word not in KEYWORD_STOPWORDS))
+
+
+# Standard RRF damping constant: dampens the weight of the very top ranks
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], limit: int, k: int = RRF_K) -> List[Dict]:
+    """
+    Merge ranked result lists from different search strategies with
+    Reciprocal Rank Fusion.
+
+    Raw scores from the strategies (cosine similarity, keyword hits, fuzzy
+    ratio) are not comparable, so each list is ranked by its own score and
+    every (type, id) earns 1 / (k + rank) from each list it appears in.
+
+    Args:
+        result_lists: One list of results per search strategy
+        limit: Number of fused results to return
+        k: RRF damping constant
+
+    Returns:
+        Top `limit` results, each carrying its fused score in 'score'
     """
-    seen = {}
-    for result in results:
-        key = (result['type'], result['id'])
-        if key not in seen or result['score'] > seen[key]['score']:
-            seen[key] = result
+    # One accumulator per (type, id), filled in a single pass over each list:
+    # [fused score, first result seen, index of the last list that counted it]
+    fused: Dict[tuple, list] = {}
+    for source, results in enumerate(result_lists):
+        # Rank each source by its own score, counting a (type, id) once per source
+        rank = 0
+        for result in sorted(results, key=itemgetter('score'), reverse=True):
+            key = (result['type'], result['id'])
+            entry = fused.get(key)
+            if entry is None:
+                rank += 1
+                fused[key] = [1.0 / (k + rank), result, source]
+            elif entry[2] != source:
+                rank += 1
+                entry[0] += 1.0 / (k + rank)
+                entry[2] = source
     
-    return list(seen.values())
+    top = heapq.nlargest(limit, fused.values(), key=itemgetter(0))
+    return [{**result, 'score': score} for score, result, _ in top]
 
 
 def combined_search(
@@ -46,86 +127,144 @@ def combined_search(
     Returns:
         Tuple of (context_string, references, raw_results)
     """
-    all_results = []
+    # Nothing searchable (blank, one character, or only punctuation): skip the
+    # embedding RPC and the search round trips entirely
+    normalized_query = " ".join(query.split())
+    if len(normalized_query) < 2 or not _WORD_RE.search(normalized_query):
+        if RAG_TRACE:
+            print(f"[RAG] Skipping search for empty query: {query!r}")
+        return "", [], []
     
-    # 1. Semantic/Vector Search (best for meaning-based queries)
-    if use_semantic:
+    cache_key = (user_id, normalized_query, top_k, use_semantic, use_keyword, use_fuzzy)
+    with _result_cache_lock:
+        cached = _result_cache.get(cache_key)
+        if cached is not None and cached[0] > time.time():
+            _result_cache.move_to_end(cache_key)
+            if RAG_TRACE:
+                print(f"[RAG] Reusing cached search results for: {query}")
+            return cached[1]
+    
+    def run_semantic():
         try:
-            print(f"[RAG] Performing semantic search for: {query}")
-            embedding = embed_text(query)
+            if RAG_TRACE:
+                print(f"[RAG] Performing semantic search for: {query}")
+            embedding = embed_query(query)
             semantic_results = vector_search(
                 user_id=user_id,
                 query_embedding=embedding,
                 search_types=None,  # Search all types
                 top_k=top_k
             )
-            all_results.extend(semantic_results)
-            print(f"[RAG] Semantic search found {len(semantic_results)} results")
+            if RAG_TRACE:
+                print(f"[RAG] Semantic search found {len(semantic_results)} results")
+            return semantic_results
         except Exception as e:
             print(f"[RAG] Error in semantic search: {e}")
+            return None
     
-    # 2. Keyword Search (best for exact words/names)
-    if use_keyword:
+    def run_keyword():
         try:
-            print(f"[RAG] Performing keyword search for: {query}")
-            # Extract keywords from query (simple word splitting)
-            keywords = [word for word in query.split() if len(word) > 2]
-            if keywords:
-                keyword_results = keyword_search(
-                    user_id=user_id,
-                    keywords=keywords,
-                    top_k=top_k
-                )
-                all_results.extend(keyword_results)
+            if RAG_TRACE:
+                print(f"[RAG] Performing keyword search for: {query}")
+            keywords = extract_keywords(query)
+            if not keywords:
+                return []
+            keyword_results = keyword_search(
+                user_id=user_id,
+                keywords=keywords,
+                top_k=top_k
+            )
+            if RAG_TRACE:
                 print(f"[RAG] Keyword search found {len(keyword_results)} results")
+            return keyword_results
         except Exception as e:
             print(f"[RAG] Error in keyword search: {e}")
+            return None
     
-    # 3. Fuzzy Search (best for approximate matches)
-    if use_fuzzy:
+    def run_fuzzy():
         try:
-            print(f"[RAG] Performing fuzzy search for: {query}")
+            if RAG_TRACE:
+                print(f"[RAG] Performing fuzzy search for: {query}")
             fuzzy_results = fuzzy_search(
                 user_id=user_id,
                 query=query,
                 top_k=top_k
             )
-            all_results.extend(fuzzy_results)
-            print(f"[RAG] Fuzzy search found {len(fuzzy_results)} results")
+            if RAG_TRACE:
+                print(f"[RAG] Fuzzy search found {len(fuzzy_results)} results")
+            return fuzzy_results
         except Exception as e:
             print(f"[RAG] Error in fuzzy search: {e}")
+            return None
     
-    # Deduplicate and sort by score
-    unique_results = deduplicate_results(all_results)
-    sorted_results = sorted(unique_results, key=lambda x: x['score'], reverse=True)
+    # 1. Semantic/Vector Search (best for meaning-based queries)
+    # 2. Keyword Search (best for exact words/names)
+    # 3. Fuzzy Search (best for approximate matches)
+    # The branches are independent, so run them concurrently: latency is the
+    # slowest branch rather than the sum (the embedding call overlaps too)
+    branches = [
+        run for run, enabled in (
+            (run_semantic, use_semantic),
+            (run_keyword, use_keyword),
+            (run_fuzzy, use_fuzzy),
+        ) if enabled
+    ]
+    futures = [_search_executor.submit(run) for run in branches]
     
-    # Limit to top_k total results
-    final_results = sorted_results[:top_k * 2]  # Allow more results for better context
+    # Early exit: once semantic search alone has top_k confident hits, don't
+    # wait on the slower keyword/fuzzy branches (they finish in the background)
+    slots = {future: i for i, future in enumerate(futures)}
+    result_lists = [[] for _ in futures]
+    all_succeeded = True
+    # Set when the early exit drops branches whose results were never read
+    skipped_branches = False
+    for seen, future in enumerate(as_completed(futures), start=1):
+        results = future.result()
+        # A failed branch yields None
+        if results is None:
+            all_succeeded = False
+            continue
+        result_lists[slots[future]] = results
+        if (
+            branches[slots[future]] is run_semantic
+            and RAG_EARLY_EXIT_SCORE > 0
+            and sum(1 for r in results if r['score'] >= RAG_EARLY_EXIT_SCORE) >= top_k
+        ):
+            pending = [f for f in futures if not f.done()]
+            if pending:
+                for f in pending:
+                    f.cancel()
+                if RAG_TRACE:
+                    print(f"[RAG] Semantic search is confident; skipping {len(pending)} slower branch(es)")
+            skipped_branches = seen < len(futures)
+            break
     
-    print(f"[RAG] Total unique results: {len(final_results)}")
+    # Fuse the per-strategy rankings (kept in submission order so ties resolve
+    # the same way on every run); allow more results than top_k for better context
+    final_results = reciprocal_rank_fusion(result_lists, limit=top_k * 2)
+    
+    if RAG_TRACE:
+        print(f"[RAG] Total unique results: {len(final_results)}")
     
     # Get full context and references
     context, references = get_context_from_results(user_id, final_results)
     
+    # Don't pin a degraded answer from a failed or skipped branch
+    if all_succeeded and not skipped_branches:
+        with _result_cache_lock:
+            _result_cache[cache_key] = (time.time() + RAG_RESULT_CACHE_TTL, (context, references, final_results))
+            _result_cache.move_to_end(cache_key)
+            while len(_result_cache) > RAG_RESULT_CACHE_MAX_ENTRIES:
+                _result_cache.popitem(last=False)
+    
     return context, references, final_results
 
 
-def build_rag_prompt(user_message: str, context: str, user_info: dict) -> str:
-    """
-    Build a prompt for RAG mode that includes the retrieved context.
-    
-    Args:
-        user_message: User's question/message
-        context: Retrieved context from search
-        user_info: User information from Google OAuth
-    
-    Returns:
-        Formatted prompt with context
-    """
-    if not context or context.strip() == "":
-        return f"""You are a helpful assistant with access to the user's personal data.
+# Static text of the RAG prompts, hoisted so each call only formats the variable parts
+_RAG_NO_CONTEXT_HEAD = """You are a helpful assistant with access to the user's personal data.
 
-The user asked: {user_message}
+The user asked: """
+_RAG_NO_CONTEXT_TAIL = """
 
 Unfortunately, I couldn't find any relevant information in your personal data to answer this question. This could mean:
 1. The information doesn't exist in your emails, calendar, or files
@@ -133,18 +272,38 @@ Unfortunately, I couldn't find any relevant information in your personal data to
 
 Please answer the user's question to the best of your ability. If it's a general knowledge question, answer it directly. If it requires personal data that wasn't found, let them know politely.
 
-User info (for reference): {user_info.get('email', 'unknown')}"""
-    
-    return f"""You are a helpful assistant analyzing the user's personal data.
+User info (for reference): """
+_RAG_CONTEXT_HEAD = """You are a helpful assistant analyzing the user's personal data.
 
-The user asked: {user_message}
+The user asked: """
+_RAG_CONTEXT_MIDDLE = """
 
 Here is the relevant information I found from your emails, calendar events, and files:
 
-{context}
+"""
+_RAG_CONTEXT_TAIL = """
 
 Please answer the user's question based on this information. Be specific and cite which sources you're using (e.g., "According to the email from...", "Based on your calendar event...", etc.).
 
 If the context doesn't fully answer the question, acknowledge what you know and what you don't know.
 
-User info (for reference): {user_info.get('email', 'unknown')}"""
+User info (for reference): """
+
+
+def build_rag_prompt(user_message: str, context: str, user_info: dict) -> str:
+    """
+    Build a prompt for RAG mode that includes the retrieved context.
+    
+    Args:
+        user_message: User's question/message
+        context: Retrieved context from search
+        user_info: User information from Google OAuth
+    
+    Returns:
+        Formatted prompt with context
+    """
+    user_email = user_info.get('email', 'unknown')
+    if not context or context.strip() == "":
+        return "".join((_RAG_NO_CONTEXT_HEAD, user_message, _RAG_NO_CONTEXT_TAIL, user_email))
+    
+    return "".join((_RAG_CONTEXT_HEAD, user_message, _RAG_CONTEXT_MIDDLE, context, _RAG_CONTEXT_TAIL, user_email))
@@ -0,0 +1,92 @@
+"""
+Client-side rate limiting for outbound API calls.
+Callers block only when they would exceed the configured rate, instead of
+sleeping unconditionally between requests.
+"""
+import os
+import asyncio
+import threading
+import time
+import weakref
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Gmail allows 250 quota units per user per second; list/get cost 5 units each
+GMAIL_REQUESTS_PER_SECOND = float(os.getenv("GMAIL_REQUESTS_PER_SECOND", "40"))
+# Drive allows 12,000 queries per user per minute; each batch sub-request counts
+DRIVE_REQUESTS_PER_SECOND = float(os.getenv("DRIVE_REQUESTS_PER_SECOND", "50"))
+# Process-wide caps for the model APIs, shared by every user
+OPENAI_REQUESTS_PER_SECOND = float(os.getenv("OPENAI_REQUESTS_PER_SECOND", "20"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+GEMINI_REQUESTS_PER_SECOND = float(os.getenv("GEMINI_REQUESTS_PER_SECOND", "25"))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiter.
+    Tokens refill continuously at `rate` per second up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        """Take tokens if available; otherwise return how long to wait before retrying"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        """
+        Take `tokens` from the bucket, sleeping only if not enough are available.
+
+        Args:
+            tokens: Number of tokens this call costs
+        """
+        while True:
+            wait_time = self._reserve(tokens)
+            if not wait_time:
+                return
+            time.sleep(wait_time)
+
+    async def acquire_async(self, tokens: float = 1.0):
+        """Like acquire(), but yields to the event loop while waiting"""
+        while True:
+            wait_time = self._reserve(tokens)
+            if not wait_time:
+                return
+            await asyncio.sleep(wait_time)
+
+
+# Shared limiters for outbound model API calls
+openai_limiter = TokenBucket(OPENAI_REQUESTS_PER_SECOND)
+# Bounds concurrent blocking (non-streaming) OpenAI calls from worker threads
+openai_semaphore = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+# Async counterpart, one per event loop (asyncio primitives can't be shared
+# across loops; the server runs one, each user initialization its own)
+_openai_async_semaphores = weakref.WeakKeyDictionary()
+_openai_async_semaphores_lock = threading.Lock()
+
+
+def get_openai_async_semaphore() -> asyncio.Semaphore:
+    """Concurrency cap for non-streaming async OpenAI calls on the running loop"""
+    loop = asyncio.get_running_loop()
+    with _openai_async_semaphores_lock:
+        semaphore = _openai_async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = _openai_async_semaphores[loop] = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    return semaphore
+
+gemini_limiter = TokenBucket(GEMINI_REQUESTS_PER_SECOND)
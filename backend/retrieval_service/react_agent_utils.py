@@ -3,11 +3,39 @@ Real ReAct Agent Implementation
 Uses Thought -> Action -> Observation loop pattern
 """
 
+import os
 import re
 import json
+import asyncio
+import traceback
 from typing import List, Dict, Tuple, AsyncGenerator
 from .search_utils import vector_search, keyword_search, fuzzy_search
-from .supabase_utils import supabase
+from .supabase_utils import get_result_rows
+from .gemni_api_utils import embed_query
+from .rate_limit_utils import openai_limiter
+
+# Columns each result type needs for the observation text
+AGENT_RESULT_COLUMNS = {
+    'email': 'id, subject, body, from_user, date',
+    'schedule': 'id, summary, description, start_time, location',
+    'file': 'id, name, summary, mime_type',
+    'attachment': 'id, filename, summary, mime_type',
+}
+
+# Observation layout per result type: (label, template, free-text field, its default)
+AGENT_RESULT_FORMATS = {
+    'email': ('Email', "Subject: {subject}\nFrom: {from_user}\nDate: {date}\n{body}", 'body', ''),
+    'schedule': ('Schedule', "Title: {summary}\nTime: {start_time}\nLocation: {location}\n{description}", 'description', ''),
+    'file': ('File', "Name: {name}\nType: {mime_type}\n{summary}", 'summary', 'No summary'),
+    'attachment': ('Attachment', "Filename: {filename}\nType: {mime_type}\n{summary}", 'summary', 'No summary'),
+}
+
+
+class _FieldDefaults(dict):
+    """Row mapping for str.format_map that renders absent columns as N/A"""
+    def __missing__(self, key):
+        return 'N/A'
+
 
 REACT_SYSTEM_PROMPT = """You are a ReAct agent helping users find information from their personal knowledge base.
 
@@ -32,6 +60,10 @@ Observation: <tool output with search results>
 
 Then continue the loop.
 
+You may write up to 3 Action lines in one step (for example the same need
+phrased for different tools); they run in parallel and you receive one
+Observation per Action, in the same order.
+
 Guidelines:
 - Think step by step about what information you need
 - Try different search strategies if one doesn't work
@@ -44,112 +76,209 @@ Action: semantic_search project emails
 """
 
 
+# One agent step line: "Final: ..." or "Action: <tool> <query>" (unknown tools don't match)
+_STEP_RE = re.compile(
+    r"^[ \t]*(?:Final:[ \t]*(?P<final>.*)"
+    r"|Action:[ \t]*(?P<tool>semantic_search|vector_search|keyword_search|fuzzy_search)(?P<query>.*))$",
+    re.MULTILINE,
+)
+
+# Upper bound on the searches the agent may batch into one step
+MAX_ACTIONS_PER_STEP = 3
+
+# Characters of each observation kept in the conversation history (result
+# header lines are always kept)
+OBSERVATION_CHAR_BUDGET = int(os.getenv("AGENT_OBSERVATION_CHAR_BUDGET", "1200"))
+
+_URL_RE = re.compile(r"https?://\S+")
+_RESULT_HEADER_RE = re.compile(r"^Result \d+ \[")
+
+
+def _step_from_match(text: str, match) -> Tuple[str, str]:
+    if match.group('final') is not None:
+        # The answer runs to the end of the output, not just the Final line
+        return 'finish', text[match.start('final'):].strip()
+    return match.group('tool'), match.group('query').strip()
+
+
 def parse_action(text: str) -> Tuple[str, str]:
-    """Parse action from agent output - simple prefix matching"""
-    lines = text.strip().split('\n')
-    
-    for line in lines:
-        line = line.strip()
-        
-        # Check for Final answer
-        if line.startswith('Final:'):
-            answer = line[6:].strip()  # Remove "Final:" prefix
-            return 'finish', answer
-        
-        # Check for Action
-        if line.startswith('Action:'):
-            action_text = line[7:].strip()  # Remove "Action:" prefix
-            
-            # Try to extract tool and query
-            if action_text.startswith('semantic_search'):
-                query = action_text[15:].strip()  # Remove "semantic_search"
-                return 'semantic_search', query
-            elif action_text.startswith('keyword_search'):
-                query = action_text[14:].strip()  # Remove "keyword_search"
-                return 'keyword_search', query
-            elif action_text.startswith('fuzzy_search'):
-                query = action_text[12:].strip()  # Remove "fuzzy_search"
-                return 'fuzzy_search', query
+    """Parse the first action (or Final answer) from agent output"""
+    match = _STEP_RE.search(text)
+    if match is None:
+        return None, None
+    return _step_from_match(text, match)
+
+
+def parse_actions(text: str) -> List[Tuple[str, str]]:
+    """
+    Parse every action from agent output.
+    A Final line before any Action ends the loop ([('finish', answer)]);
+    otherwise all Action lines are returned in order (at most
+    MAX_ACTIONS_PER_STEP), or [] if there are none.
+    """
+    actions = []
+    for match in _STEP_RE.finditer(text):
+        tool, arg = _step_from_match(text, match)
+        if tool == 'finish':
+            if not actions:
+                return [(tool, arg)]
+            break
+        actions.append((tool, arg))
+        if len(actions) == MAX_ACTIONS_PER_STEP:
+            break
+    return actions
+
+
+def compress_observation(observation: str, budget: int = OBSERVATION_CHAR_BUDGET) -> str:
+    """
+    Shorten an observation before it goes back into the agent's prompt.
+    URLs and quoted reply lines are dropped, then the text is cut to budget
+    characters; result header lines past the cut are still kept so the model
+    knows what else was found.
+    """
+    lines = []
+    for line in _URL_RE.sub("", observation).split("\n"):
+        if line.lstrip().startswith(">"):
+            continue
+        lines.append(line.rstrip())
+    text = "\n".join(lines)
+    if len(text) <= budget:
+        return text
     
-    return None, None
+    kept = text[:budget].rstrip() + "..."
+    headers = [line for line in text[budget:].split("\n") if _RESULT_HEADER_RE.match(line)]
+    return "\n".join([kept] + headers)
 
 
-async def execute_search_tool(tool: str, arg: str, user_id: str) -> str:
-    """Execute a search tool and return formatted observation"""
+async def execute_search_tool(tool: str, arg: str, user_id: str, row_cache: Dict = None) -> str:
+    """
+    Execute a search tool and return formatted observation.
+    row_cache: optional {(type, id): row} shared across one agent run, so
+    results seen in an earlier step aren't fetched again.
+    """
     try:
         # Parse the query from arg
         query = arg.strip()
         
-        if tool == "vector_search":
+        # The prompt calls the embedding search "semantic_search"
+        if tool in ("vector_search", "semantic_search"):
             # Use embedding-based search
-            from .gemni_api_utils import embed_text
-            query_embedding = embed_text(query)
-            from .search_utils import vector_search
-            results = vector_search(user_id, query_embedding, top_k=3)
+            # Blocking calls (embedding retries, Supabase) run off the event loop
+            query_embedding = await asyncio.to_thread(embed_query, query)
+            results = await asyncio.to_thread(vector_search, user_id, query_embedding, top_k=3)
         elif tool == "keyword_search":
             # Keyword search with single query
-            results = keyword_search(user_id, [query], top_k=3)
+            results = await asyncio.to_thread(keyword_search, user_id, [query], top_k=3)
         elif tool == "fuzzy_search":
-            results = fuzzy_search(user_id, query, top_k=3)
+            results = await asyncio.to_thread(fuzzy_search, user_id, query, top_k=3)
         else:
             return f"[ERROR] Unknown tool: {tool}"
         
         if not results:
             return "No results found."
         
+        # Fetch the rows behind all results at once (one request per type, not per result)
+        rows = await asyncio.to_thread(get_result_rows, user_id, results, AGENT_RESULT_COLUMNS, row_cache)
+        
         # Format results with context from database
         formatted = []
         for i, result in enumerate(results, 1):
-            result_type = result.get('type')
-            result_id = result.get('id')
-            score = result.get('score', 0)
-            
-            try:
-                # Fetch content based on type
-                if result_type == 'email':
-                    response = supabase.table('emails').select('subject, body, from_user, date')\
-                        .eq('user_id', user_id).eq('id', result_id).execute()
-                    if response.data:
-                        email = response.data[0]
-                        content = f"Subject: {email.get('subject', 'N/A')}\nFrom: {email.get('from_user', 'N/A')}\nDate: {email.get('date', 'N/A')}\n{email.get('body', '')[:200]}"
-                        formatted.append(f"Result {i} [Email] (score: {score:.3f}):\n{content}")
-                
-                elif result_type == 'schedule':
-                    response = supabase.table('schedules').select('summary, description, start_time, location')\
-                        .eq('user_id', user_id).eq('id', result_id).execute()
-                    if response.data:
-                        schedule = response.data[0]
-                        content = f"Title: {schedule.get('summary', 'N/A')}\nTime: {schedule.get('start_time', 'N/A')}\nLocation: {schedule.get('location', 'N/A')}\n{schedule.get('description', '')[:200]}"
-                        formatted.append(f"Result {i} [Schedule] (score: {score:.3f}):\n{content}")
-                
-                elif result_type == 'file':
-                    response = supabase.table('files').select('name, summary, mime_type')\
-                        .eq('user_id', user_id).eq('id', result_id).execute()
-                    if response.data:
-                        file = response.data[0]
-                        content = f"Name: {file.get('name', 'N/A')}\nType: {file.get('mime_type', 'N/A')}\n{file.get('summary', 'No summary')[:200]}"
-                        formatted.append(f"Result {i} [File] (score: {score:.3f}):\n{content}")
-                
-                elif result_type == 'attachment':
-                    response = supabase.table('attachments').select('filename, summary, mime_type')\
-                        .eq('user_id', user_id).eq('id', result_id).execute()
-                    if response.data:
-                        attachment = response.data[0]
-                        content = f"Filename: {attachment.get('filename', 'N/A')}\nType: {attachment.get('mime_type', 'N/A')}\n{attachment.get('summary', 'No summary')[:200]}"
-                        formatted.append(f"Result {i} [Attachment] (score: {score:.3f}):\n{content}")
+            # Every search backend sets type, id and score on its results
+            result_type = result['type']
+            result_id = result['id']
+            score = result['score']
+            row = rows.get((result_type, result_id))
+            if row is None:
+                continue
             
-            except Exception as e:
-                print(f"Error fetching {result_type} {result_id}: {e}")
+            result_format = AGENT_RESULT_FORMATS.get(result_type)
+            if result_format is None:
                 continue
+            label, template, text_field, text_default = result_format
+            
+            # Missing columns render as N/A; the free-text field is cut to 200 chars
+            fields = _FieldDefaults(row)
+            fields[text_field] = (row.get(text_field) or text_default)[:200]
+            formatted.append(f"Result {i} [{label}] (score: {score:.3f}):\n" + template.format_map(fields))
         
         return "\n\n".join(formatted) if formatted else "No results found."
     
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return f"[ERROR] {str(e)}"
 
 
+async def _stream_step(async_client, agent_messages: List[Dict], user_id: str, row_cache: Dict) -> Tuple[str, Dict]:
+    """
+    Stream one agent step and start each search as soon as its Action line
+    is complete, instead of waiting for the whole completion.
+
+    Returns:
+        (output text read, {(tool, query): running search task}); reading stops
+        early once MAX_ACTIONS_PER_STEP actions are in
+    """
+    await openai_limiter.acquire_async()
+    stream = await async_client.chat.completions.create(
+        model="gpt-4o",
+        messages=agent_messages,
+        temperature=0,
+        stream=True,
+        # Observations come from us; stop before the model invents one
+        stop=["\nObservation:"]
+    )
+    
+    parts = []
+    pending = ""
+    searches = {}
+    scanning = True
+    actions_seen = 0
+    
+    def scan(line: str) -> str:
+        """
+        Start the search for a complete Action line.
+        Returns "more" to keep scanning, "final" after a Final line (keep
+        reading, the answer follows) or "full" once the step has its maximum
+        number of actions (nothing after that is used, so stop reading).
+        """
+        nonlocal actions_seen
+        match = _STEP_RE.match(line)
+        if match is None:
+            return "more"
+        tool, arg = _step_from_match(line, match)
+        if tool == 'finish':
+            return "final"
+        actions_seen += 1
+        if (tool, arg) not in searches:
+            searches[(tool, arg)] = asyncio.create_task(execute_search_tool(tool, arg, user_id, row_cache))
+        return "full" if actions_seen == MAX_ACTIONS_PER_STEP else "more"
+    
+    try:
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            parts.append(delta)
+            if not scanning:
+                continue
+            pending += delta
+            *lines, pending = pending.split("\n")
+            state = "more"
+            for line in lines:
+                state = scan(line)
+                if state != "more":
+                    scanning = False
+                    break
+            if state == "full":
+                break
+        if scanning and pending:
+            scan(pending)
+    finally:
+        # Also cancels generation when we stopped reading early
+        await stream.close()
+    
+    return "".join(parts), searches
+
+
 async def react_agent_stream(messages: List[Dict], user_id: str, max_iterations: int = 10) -> AsyncGenerator:
     """
     Real ReAct agent with Thought-Action-Observation loop
@@ -162,19 +291,16 @@ async def react_agent_stream(messages: List[Dict], user_id: str, max_iterations:
         {"role": "system", "content": REACT_SYSTEM_PROMPT}
     ] + messages
     
+    # Rows already hydrated during this run, reused when searches overlap
+    row_cache = {}
     iteration = 0
     
     while iteration < max_iterations:
         iteration += 1
         
-        # Get agent's thought and action
-        response = await async_client.chat.completions.create(
-            model="gpt-4o",
-            messages=agent_messages,
-            temperature=0
-        )
-        
-        output = response.choices[0].message.content
+        # Get agent's thought and action; searches start as soon as their
+        # Action line has streamed in, overlapping the rest of the generation
+        output, searches = await _stream_step(async_client, agent_messages, user_id, row_cache)
         
         # Stream the thought process
         yield {
@@ -183,36 +309,51 @@ async def react_agent_stream(messages: List[Dict], user_id: str, max_iterations:
             "content": output
         }
         
-        # Parse action
-        tool, arg = parse_action(output)
+        # Parse actions
+        actions = parse_actions(output)
         
-        if not tool:
+        if not actions:
             # No valid action found, append and continue
             agent_messages.append({"role": "assistant", "content": output})
             continue
         
         # Check if finish action
-        if tool == "finish":
+        if actions[0][0] == "finish":
+            for task in searches.values():
+                task.cancel()
             # Stream final answer
             yield {
                 "type": "react_final",
-                "answer": arg
+                "answer": actions[0][1]
             }
             return
         
-        # Execute search tool
-        observation = await execute_search_tool(tool, arg, user_id)
+        # Wait for this step's searches (all running concurrently); any the
+        # incremental scan did not start are started now
+        observations = await asyncio.gather(*(
+            searches.get(action) or execute_search_tool(action[0], action[1], user_id, row_cache)
+            for action in actions
+        ))
         
-        # Stream observation
-        yield {
-            "type": "react_observation",
-            "tool": tool,
-            "observation": observation
-        }
+        # Stream observations in action order
+        for (tool, _), observation in zip(actions, observations):
+            yield {
+                "type": "react_observation",
+                "tool": tool,
+                "observation": observation
+            }
         
-        # Add to conversation history
+        # Add to conversation history, compressed once here and never rewritten,
+        # so each call's prompt extends the previous one (the UI got the full text above)
+        if len(observations) == 1:
+            observation_text = f"Observation: {compress_observation(observations[0])}"
+        else:
+            observation_text = "\n\n".join(
+                f"Observation {i} ({tool} {arg}): {compress_observation(observation)}"
+                for i, ((tool, arg), observation) in enumerate(zip(actions, observations), 1)
+            )
         agent_messages.append({"role": "assistant", "content": output})
-        agent_messages.append({"role": "user", "content": f"Observation: {observation}"})
+        agent_messages.append({"role": "user", "content": observation_text})
     
     # Max iterations reached
     yield {
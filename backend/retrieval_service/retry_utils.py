@@ -0,0 +1,174 @@
+"""
+Shared helpers for retrying flaky external API calls (Gemini, Google, Supabase).
+"""
+import re
+import time
+import random
+import asyncio
+import functools
+import inspect
+from email.utils import parsedate_to_datetime
+
+# HTTP statuses worth retrying (rate limit, transient server errors)
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# Google reports per-user throttling as 403 with reason rateLimitExceeded /
+# userRateLimitExceeded ("User Rate Limit Exceeded" in the message)
+_RATE_LIMIT_403_RE = re.compile(r"rate\s*limit\s*exceeded", re.IGNORECASE)
+
+# Fallback for SDKs that only surface the failure in the message text
+_RETRYABLE_RE = re.compile(r"\b(?:429|500|502|503|504)\b|deadline|timeout|timed out|too many requests", re.IGNORECASE)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Decide whether a failed API call is worth retrying.
+    Connection resets and socket timeouts always qualify. Otherwise checks
+    the structured status code first (`status_code` on OpenAI errors,
+    `code` on google-api-core errors, `resp.status` on googleapiclient's
+    HttpError; a 403 counts only for rate-limit reasons), then falls back to
+    scanning the message.
+    """
+    # Reset or timed-out sockets (socket.timeout is TimeoutError)
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(error, "code", None)
+    if status is None:
+        status = getattr(getattr(error, "resp", None), "status", None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        status = None
+    if status in RETRYABLE_STATUS_CODES:
+        return True
+    if status == 403:
+        # Quota 403s are transient; permission 403s are not
+        content = getattr(error, "content", b"")
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", "replace")
+        return _RATE_LIMIT_403_RE.search(f"{error} {content}") is not None
+
+    return _RETRYABLE_RE.search(str(error)) is not None
+
+
+def compute_backoff(attempt: int, base: float = 1.0, cap: float = 30.0, jitter: float = 0.5) -> float:
+    """
+    Exponential backoff with multiplicative jitter.
+
+    Args:
+        attempt: Zero-based attempt number that just failed
+        base: Wait before the first retry, in seconds
+        cap: Upper bound on the un-jittered wait
+        jitter: Maximum extra fraction added at random, so workers that
+            failed together do not retry in lockstep
+
+    Returns:
+        float: Seconds to wait before the next attempt
+    """
+    return min(cap, base * (2 ** attempt)) * (1 + random.uniform(0, jitter))
+
+
+def get_retry_after(error: Exception):
+    """
+    Extract the server's Retry-After hint from an API exception, if any.
+
+    Understands exceptions carrying a requests/httpx response (`error.response`,
+    as raised by the OpenAI SDK and google-api-core REST errors) and
+    googleapiclient's HttpError (`error.resp`, an httplib2 response).
+
+    Returns:
+        float | None: Seconds to wait, or None when no usable hint is present
+    """
+    value = None
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+    else:
+        resp = getattr(error, "resp", None)
+        if resp is not None and hasattr(resp, "get"):
+            value = resp.get("retry-after")
+
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+
+    # HTTP-date form
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def with_retry(
+    *,
+    retries: int = 3,
+    base: float = 1.0,
+    cap: float = 30.0,
+    jitter: float = 0.5,
+    retryable=is_retryable_error,
+    label: str = None,
+):
+    """
+    Decorator that retries a sync or async function on transient failures.
+
+    Waits for the longer of the jittered exponential backoff and the server's
+    Retry-After hint, never more than cap; async callees sleep with asyncio.sleep so the event loop
+    keeps running. The last error is re-raised once retries are exhausted.
+
+    Args:
+        retries: Total number of attempts
+        base, cap, jitter: Backoff parameters, see compute_backoff (cap also
+            limits how long a Retry-After hint is honoured)
+        retryable: Predicate deciding whether an exception is worth retrying
+        label: Name used in log lines (defaults to the function name)
+    """
+    def decorator(fn):
+        name = label or fn.__name__
+
+        def next_wait(attempt, error):
+            """Seconds to sleep before retrying, or None to give up."""
+            if attempt >= retries - 1 or not retryable(error):
+                print(f"[RETRY] {name} failed after {attempt + 1} attempt(s): {error}")
+                return None
+            backoff = compute_backoff(attempt, base=base, cap=cap, jitter=jitter)
+            server_wait = get_retry_after(error)
+            # cap also bounds Retry-After, so a huge or hostile header can't park the caller
+            wait_time = min(cap, max(server_wait or 0, backoff))
+            print(f"[RETRY] {name} error (attempt {attempt + 1}/{retries}): {error}. Retrying in {wait_time:.2f}s "
+                  f"(backoff {backoff:.2f}s, Retry-After {server_wait})...")
+            return wait_time
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                for attempt in range(retries):
+                    try:
+                        return await fn(*args, **kwargs)
+                    except Exception as e:
+                        wait_time = next_wait(attempt, e)
+                        if wait_time is None:
+                            raise
+                        await asyncio.sleep(wait_time)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            for attempt in range(retries):
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    wait_time = next_wait(attempt, e)
+                    if wait_time is None:
+                        raise
+                    time.sleep(wait_time)
+        return wrapper
+
+    return decorator
@@ -2,19 +2,35 @@
 Search utilities combining vector search, keyword search, and fuzzy search
 """
 
-from retrieval_service.supabase_utils import supabase
-from retrieval_service.gemni_api_utils import embed_text
+from retrieval_service.supabase_utils import supabase, get_result_rows, get_rows_by_ids, row_cache_lock
+from retrieval_service.gemni_api_utils import embed_query
 from typing import List, Dict, Tuple, Any
 import os
 from dotenv import load_dotenv
 from rapidfuzz import fuzz
 import traceback
+import asyncio
+import heapq
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 
 
 load_dotenv()
 
 DEFAULT_TOP_K = int(os.getenv("SEARCH_TOP_K", "5"))
 
+# Similarity RPC and id column per result type (see docs/db_init.sql)
+VECTOR_MATCH_RPCS = {
+    'email': ('match_email_embeddings', 'email_id'),
+    'schedule': ('match_schedule_embeddings', 'schedule_id'),
+    'file': ('match_file_embeddings', 'file_id'),
+    'attachment': ('match_attachment_embeddings', 'attachment_id'),
+}
+
+# Shared pool for the per-type vector RPCs
+VECTOR_SEARCH_WORKERS = int(os.getenv("VECTOR_SEARCH_WORKERS", "16"))
+_vector_executor = ThreadPoolExecutor(max_workers=VECTOR_SEARCH_WORKERS, thread_name_prefix="vector-search")
+
 
 def vector_search(
     user_id: str,
@@ -42,97 +58,47 @@ def vector_search(
             'attachment_context'
         ]
 
-    results = []
-
-    for search_type in search_types:
+    def search_one(search_type):
+        for kind, (rpc_name, id_field) in VECTOR_MATCH_RPCS.items():
+            if kind in search_type:
+                break
+        else:
+            return []
         try:
-            if 'email' in search_type:
-                response = supabase.rpc(
-                    'match_email_embeddings',
-                    {
-                        '_user_id': user_id,
-                        '_query_embedding': query_embedding,
-                        '_type': search_type,
-                        '_match_threshold': 0.2,
-                        '_match_count': top_k
-                    }
-                ).execute()
-
-                for item in response.data:
-                    results.append({
-                        'type': 'email',
-                        'id': item['email_id'],
-                        'embedding_type': item['type'],
-                        'score': item['similarity'],
-                        'source': 'vector'
-                    })
-
-            elif 'schedule' in search_type:
-                response = supabase.rpc(
-                    'match_schedule_embeddings',
-                    {
-                        '_user_id': user_id,
-                        '_query_embedding': query_embedding,
-                        '_type': search_type,
-                        '_match_threshold': 0.2,
-                        '_match_count': top_k
-                    }
-                ).execute()
-
-                for item in response.data:
-                    results.append({
-                        'type': 'schedule',
-                        'id': item['schedule_id'],
-                        'embedding_type': item['type'],
-                        'score': item['similarity'],
-                        'source': 'vector'
-                    })
-
-            elif 'file' in search_type:
-                response = supabase.rpc(
-                    'match_file_embeddings',
-                    {
-                        '_user_id': user_id,
-                        '_query_embedding': query_embedding,
-                        '_type': search_type,
-                        '_match_threshold': 0.2,
-                        '_match_count': top_k
-                    }
-                ).execute()
-
-                for item in response.data:
-                    results.append({
-                        'type': 'file',
-                        'id': item['file_id'],
-                        'embedding_type': item['type'],
-                        'score': item['similarity'],
-                        'source': 'vector'
-                    })
-
-            elif 'attachment' in search_type:
-                response = supabase.rpc(
-                    'match_attachment_embeddings',
-                    {
-                        '_user_id': user_id,
-                        '_query_embedding': query_embedding,
-                        '_type': search_type,
-                        '_match_threshold': 0.2,
-                        '_match_count': top_k
-                    }
-                ).execute()
-
-                for item in response.data:
-                    results.append({
-                        'type': 'attachment',
-                        'id': item['attachment_id'],
-                        'embedding_type': item['type'],
-                        'score': item['similarity'],
-                        'source': 'vector'
-                    })
-
+            response = supabase.rpc(
+                rpc_name,
+                {
+                    '_user_id': user_id,
+                    '_query_embedding': query_embedding,
+                    '_type': search_type,
+                    '_match_threshold': 0.2,
+                    '_match_count': top_k
+                }
+            ).execute()
+            return [
+                {
+                    'type': kind,
+                    'id': item[id_field],
+                    'embedding_type': item['type'],
+                    'score': item['similarity'],
+                    'source': 'vector'
+                }
+                for item in response.data
+            ]
         except Exception as e:
             print(f"Error in vector search for {search_type}: {e}")
+            return []
+
+    # Each type is its own HNSW-indexed RPC; run them concurrently and keep
+    # the results in search_types order
+    if len(search_types) > 1:
+        per_type = _vector_executor.map(search_one, search_types)
+    else:
+        per_type = map(search_one, search_types)
 
+    results = []
+    for type_results in per_type:
+        results.extend(type_results)
     return results
 
 
@@ -396,157 +362,175 @@ def fuzzy_search(
     except Exception as e:
         print("Error in fuzzy attachment search:", e)
 
-    results = sorted(results, key=lambda x: x["score"], reverse=True)
+    return heapq.nlargest(top_k, results, key=itemgetter("score"))
 
-    return results[:top_k]
+
+# Columns get_context_from_results renders per result type (no ids of owners,
+# Drive parents, Calendar links, ...)
+CONTEXT_RESULT_COLUMNS = {
+    'email': 'id, from_user, to_user, cc, bcc, subject, date, body',
+    'schedule': 'id, summary, description, location, start_time, end_time',
+    'file': 'id, name, size, metadata, path, mime_type, summary',
+    'attachment': 'id, email_id, filename, mime_type, size, summary',
+}
+# Header fields of an attachment's parent email (its body is never shown)
+ATTACHMENT_EMAIL_COLUMNS = 'id, from_user, to_user, cc, bcc, date, subject'
 
 
 def get_context_from_results(
     user_id: str,
-    search_results: List[Dict]
+    search_results: List[Dict],
+    row_cache: Dict = None
 ) -> Tuple[str, List[Dict]]:
     """
     Fetch full content from search results and format as context.
+    row_cache: optional {(type, id): row} reused across calls of one agent run.
     """
     context_parts = []
     references = []
 
+    # One request per result type (plus one for attachment emails) instead of
+    # one or two per result
+    rows = get_result_rows(user_id, search_results, CONTEXT_RESULT_COLUMNS, cache=row_cache)
+    attachment_email_ids = []
+    for result in search_results:
+        if result['type'] == 'attachment':
+            row = rows.get(('attachment', result['id']))
+            if row and row.get('email_id'):
+                attachment_email_ids.append(row['email_id'])
+    if row_cache is None:
+        attachment_emails = get_rows_by_ids('emails', user_id, attachment_email_ids, ATTACHMENT_EMAIL_COLUMNS)
+    else:
+        # Parent emails are header-only rows, so they get their own cache key
+        # rather than standing in for full email results
+        with row_cache_lock:
+            attachment_emails = {
+                email_id: row_cache[('attachment_email', email_id)]
+                for email_id in attachment_email_ids if ('attachment_email', email_id) in row_cache
+            }
+        missing = [email_id for email_id in attachment_email_ids if email_id not in attachment_emails]
+        fetched = get_rows_by_ids('emails', user_id, missing, ATTACHMENT_EMAIL_COLUMNS)
+        if fetched:
+            attachment_emails.update(fetched)
+            with row_cache_lock:
+                for email_id, email in fetched.items():
+                    row_cache[('attachment_email', email_id)] = email
+
     for result in search_results:
         result_type = result['type']
         result_id = result['id']
+        row = rows.get((result_type, result_id))
+        if row is None:
+            continue
 
         try:
             if result_type == 'email':
-                response = supabase.table('emails').select('*')\
-                    .eq('user_id', user_id).eq('id', result_id).execute()
-                if response.data:
-                    email = response.data[0]
-                    context_parts.append(
-                        f"[Email] From: {email.get('from_user', 'unknown')}, "
-                        f"To: {email.get('to_user', 'unknown')}\n"
-                        f"CC: {email.get('cc', '')}, BCC: {email.get('bcc', '')}\n"
-                        f"Email ID: {email.get('id', 'unknown')}\n"
-                        f"Subject: {email.get('subject', 'No subject')}, "
-                        f"Date: {email.get('date', 'unknown')}\n"
-                        f"Content: {email.get('body', '')}\n"
-                    )
-                    references.append({
-                        'type': 'email',
-                        'id': result_id,
-                        'title': email.get('subject', 'No subject'),
-                        'from': email.get('from_user', 'unknown'),
-                        'date': email.get('date', 'unknown')
-                    })
+                email = row
+                context_parts.append(
+                    f"[Email] From: {email.get('from_user', 'unknown')}, "
+                    f"To: {email.get('to_user', 'unknown')}\n"
+                    f"CC: {email.get('cc', '')}, BCC: {email.get('bcc', '')}\n"
+                    f"Email ID: {email.get('id', 'unknown')}\n"
+                    f"Subject: {email.get('subject', 'No subject')}, "
+                    f"Date: {email.get('date', 'unknown')}\n"
+                    f"Content: {email.get('body', '')}\n"
+                )
+                references.append({
+                    'type': 'email',
+                    'id': result_id,
+                    'title': email.get('subject', 'No subject'),
+                    'from': email.get('from_user', 'unknown'),
+                    'date': email.get('date', 'unknown')
+                })
 
             elif result_type == 'schedule':
-                response = supabase.table('schedules').select('*')\
-                    .eq('user_id', user_id).eq('id', result_id).execute()
-                if response.data:
-                    schedule = response.data[0]
-                    context_parts.append(
-                        f"[Calendar Event] {schedule.get('summary', 'No title')}\n"
-                        f"Description: {schedule.get('description', 'No description')}\n"
-                        f"Location: {schedule.get('location', 'No location')}\n"
-                        f"Time: {schedule.get('start_time', 'unknown')} "
-                        f"to {schedule.get('end_time', 'unknown')}\n"
-                    )
-                    references.append({
-                        'type': 'schedule',
-                        'id': result_id,
-                        'title': schedule.get('summary', 'No title'),
-                        'start_time': schedule.get('start_time', 'unknown'),
-                        'location': schedule.get('location', 'No location')
-                    })
+                schedule = row
+                context_parts.append(
+                    f"[Calendar Event] {schedule.get('summary', 'No title')}\n"
+                    f"Description: {schedule.get('description', 'No description')}\n"
+                    f"Location: {schedule.get('location', 'No location')}\n"
+                    f"Time: {schedule.get('start_time', 'unknown')} "
+                    f"to {schedule.get('end_time', 'unknown')}\n"
+                )
+                references.append({
+                    'type': 'schedule',
+                    'id': result_id,
+                    'title': schedule.get('summary', 'No title'),
+                    'start_time': schedule.get('start_time', 'unknown'),
+                    'location': schedule.get('location', 'No location')
+                })
 
             elif result_type == 'file':
-                response = supabase.table('files').select('*')\
-                    .eq('user_id', user_id).eq('id', result_id).execute()
-                if response.data:
-                    file = response.data[0]
-                    context_parts.append(
-                        f"[File] {file.get('name', 'unknown')}\n"
-                        f"ID: {file.get('id', 'unknown')}\n"
-                        f'Size: {file.get("size", "unknown")} bytes\n'
-                        f"Metadata: {file.get('metadata', 'No metadata')}\n"
-                        f"Path: {file.get('path', 'unknown')}\n"
-                        f"Type: {file.get('mime_type', 'unknown')}\n"
-                        f"Summary: {file.get('summary', 'No summary available')}\n"
-                    )
-                    references.append({
-                        'type': 'file',
-                        'id': result_id,
-                        'title': file.get('name', 'unknown'),
-                        'path': file.get('path', 'unknown'),
-                        'mime_type': file.get('mime_type', 'unknown')
-                    })
+                file = row
+                context_parts.append(
+                    f"[File] {file.get('name', 'unknown')}\n"
+                    f"ID: {file.get('id', 'unknown')}\n"
+                    f'Size: {file.get("size", "unknown")} bytes\n'
+                    f"Metadata: {file.get('metadata', 'No metadata')}\n"
+                    f"Path: {file.get('path', 'unknown')}\n"
+                    f"Type: {file.get('mime_type', 'unknown')}\n"
+                    f"Summary: {file.get('summary', 'No summary available')}\n"
+                )
+                references.append({
+                    'type': 'file',
+                    'id': result_id,
+                    'title': file.get('name', 'unknown'),
+                    'path': file.get('path', 'unknown'),
+                    'mime_type': file.get('mime_type', 'unknown')
+                })
 
             elif result_type == 'attachment':
-                response = supabase.table('attachments').select('*')\
-                    .eq('user_id', user_id).eq('id', result_id).execute()
-                if response.data:
-                    attachment = response.data[0]
-                    email_id = attachment.get('email_id', 'unknown')
-
-                    email_info = None
-                    try:
-                        email_response = supabase.table('emails').select('*')\
-                            .eq('user_id', user_id).eq('id', email_id).execute()
-                        if email_response.data:
-                            email_info = email_response.data[0]
-                    except Exception as e:
-                        print(f"Error fetching email info for attachment {result_id}: {e}")
-
-                    context_text = (
-                        f"[Email Attachment] {attachment.get('filename', 'unknown')}\n"
-                        f"ID: {attachment.get('id', 'unknown')}\n"
-                        f"Type: {attachment.get('mime_type', 'unknown')}\n"
-                        f"Size: {attachment.get('size', 'unknown')} bytes\n"
-                    )
-
-                    if email_info:
-                        context_text += (
-                            f"From email sent by: {email_info.get('from_user', 'unknown')}\n"
-                            f"To: {email_info.get('to_user', 'unknown')}\n"
-                        )
-                        if email_info.get('cc'):
-                            context_text += f"CC: {email_info.get('cc')}\n"
-                        if email_info.get('bcc'):
-                            context_text += f"BCC: {email_info.get('bcc')}\n"
-                        context_text += (
-                            f"Email date: {email_info.get('date', 'unknown')}\n"
-                            f"Email subject: {email_info.get('subject', 'No subject')}\n"
-                        )
-
-                    context_text += (
-                        f"Summary: {attachment.get('summary', 'No summary available')}\n"
-                    )
-                    context_parts.append(context_text)
-
-                    ref = {
-                        'type': 'attachment',
-                        'id': result_id,
-                        'title': attachment.get('filename', 'unknown'),
-                        'mime_type': attachment.get('mime_type', 'unknown'),
-                        'email_id': email_id
-                    }
-
-                    if email_info:
-                        ref['from'] = email_info.get('from_user', 'unknown')
-                        ref['to'] = email_info.get('to_user', 'unknown')
-                        ref['cc'] = email_info.get('cc', '')
-                        ref['bcc'] = email_info.get('bcc', '')
-                        ref['date'] = email_info.get('date', 'unknown')
-                        ref['subject'] = email_info.get('subject', 'No subject')
-
-                    references.append(ref)
+                attachment = row
+                email_id = attachment.get('email_id', 'unknown')
+
+                email_info = attachment_emails.get(email_id)
+
+                # Collect the lines and join once instead of growing a string with +=
+                lines = [
+                    f"[Email Attachment] {attachment.get('filename', 'unknown')}",
+                    f"ID: {attachment.get('id', 'unknown')}",
+                    f"Type: {attachment.get('mime_type', 'unknown')}",
+                    f"Size: {attachment.get('size', 'unknown')} bytes",
+                ]
+
+                if email_info:
+                    lines.append(f"From email sent by: {email_info.get('from_user', 'unknown')}")
+                    lines.append(f"To: {email_info.get('to_user', 'unknown')}")
+                    if email_info.get('cc'):
+                        lines.append(f"CC: {email_info.get('cc')}")
+                    if email_info.get('bcc'):
+                        lines.append(f"BCC: {email_info.get('bcc')}")
+                    lines.append(f"Email date: {email_info.get('date', 'unknown')}")
+                    lines.append(f"Email subject: {email_info.get('subject', 'No subject')}")
+
+                lines.append(f"Summary: {attachment.get('summary', 'No summary available')}")
+                context_parts.append("\n".join(lines) + "\n")
+
+                ref = {
+                    'type': 'attachment',
+                    'id': result_id,
+                    'title': attachment.get('filename', 'unknown'),
+                    'mime_type': attachment.get('mime_type', 'unknown'),
+                    'email_id': email_id
+                }
+
+                if email_info:
+                    ref['from'] = email_info.get('from_user', 'unknown')
+                    ref['to'] = email_info.get('to_user', 'unknown')
+                    ref['cc'] = email_info.get('cc', '')
+                    ref['bcc'] = email_info.get('bcc', '')
+                    ref['date'] = email_info.get('date', 'unknown')
+                    ref['subject'] = email_info.get('subject', 'No subject')
+
+                references.append(ref)
 
         except Exception as e:
-            print(f"Error fetching {result_type} {result_id}: {e}")
+            print(f"Error formatting {result_type} {result_id}: {e}")
 
     context_str = "\n---\n".join(context_parts)
     return context_str, references
 
-async def execute_search_tool(function_name: str, arguments: Dict[str, Any], user_id: str) -> Dict:
+async def execute_search_tool(function_name: str, arguments: Dict[str, Any], user_id: str, row_cache: Dict = None) -> Dict:
     """
     Execute a search tool invoked by the LLM during ReAct.
     Returns a dict suitable for LLM tool messages:
@@ -554,13 +538,14 @@ async def execute_search_tool(function_name: str, arguments: Dict[str, Any], use
             "ok": true/false,
             "results": [...],
             "context": "...",
-            "references": [...],
-            "raw_results": ...
+            "references": [...]
         }
 
     NOTE:
         - All search functions must already be imported from your code above.
-        - embedding API (embed_text) is also imported.
+        - embedding API (embed_query) is also imported.
+        - row_cache: optional {(type, id): row} shared by the calls of one
+          agent run, so rows returned again by later searches aren't refetched.
     """
 
     try:
@@ -579,8 +564,10 @@ async def execute_search_tool(function_name: str, arguments: Dict[str, Any], use
             if not query:
                 return {"ok": False, "error": "vector_search requires query (string)"}
 
-            embedding = embed_text(query)
-            raw_results = vector_search(
+            # Blocking calls (embedding retries, Supabase) run off the event loop
+            embedding = await asyncio.to_thread(embed_query, query)
+            raw_results = await asyncio.to_thread(
+                vector_search,
                 user_id=user_id,
                 query_embedding=embedding,
                 search_types=search_types,
@@ -592,7 +579,8 @@ async def execute_search_tool(function_name: str, arguments: Dict[str, Any], use
                 return {"ok": False, "error": "keyword_search requires keywords or query"}
 
             kw = keywords or [query]
-            raw_results = keyword_search(
+            raw_results = await asyncio.to_thread(
+                keyword_search,
                 user_id=user_id,
                 keywords=kw,
                 top_k=top_k,
@@ -602,7 +590,8 @@ async def execute_search_tool(function_name: str, arguments: Dict[str, Any], use
             if not query:
                 return {"ok": False, "error": "fuzzy_search requires query"}
 
-            raw_results = fuzzy_search(
+            raw_results = await asyncio.to_thread(
+                fuzzy_search,
                 user_id=user_id,
                 query=query,
                 top_k=top_k,
@@ -617,7 +606,7 @@ async def execute_search_tool(function_name: str, arguments: Dict[str, Any], use
         # ----------------------------------------------------
         # 3) Expand context & references
         # ----------------------------------------------------
-        context, references = get_context_from_results(user_id, raw_results)
+        context, references = await asyncio.to_thread(get_context_from_results, user_id, raw_results, row_cache)
 
         # ----------------------------------------------------
         # 4) Return to LLM
@@ -626,8 +615,7 @@ async def execute_search_tool(function_name: str, arguments: Dict[str, Any], use
             "ok": True,
             "results": raw_results,
             "context": context,
-            "references": references,
-            "raw_results": raw_results  # optional: give model raw items
+            "references": references
         }
 
     except Exception as e:
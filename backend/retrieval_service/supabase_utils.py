@@ -1,6 +1,12 @@
 import os
-from supabase import create_client, Client
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from supabase import create_client, Client, ClientOptions
+from postgrest.types import ReturnMethod
 from dotenv import load_dotenv
+from retrieval_service.retry_utils import with_retry
 
 load_dotenv()
 
@@ -8,21 +14,127 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Database connections are pooled by PostgREST (Supabase's pooler), not here;
+# this client only keeps its HTTP connections alive. Bound each request so a
+# stalled call can't pin an init worker for the library default of 120 s.
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "30"))
+
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT),
+)
+
+
+def first_row(response):
+    """First row of a PostgREST response, or None if it returned no rows"""
+    data = response.data
+    return data[0] if data else None
+
+
+def dedupe_records(records: list, key_fields: tuple) -> list:
+    """
+    Drop rows that repeat a primary key within one upsert payload (last one wins).
+    Postgres rejects the whole statement if ON CONFLICT would touch a row twice.
+    """
+    unique = {}
+    for record in records:
+        unique[tuple(record.get(field) for field in key_fields)] = record
+    if len(unique) == len(records):
+        return records
+    return list(unique.values())
+
+
+# Rows per upsert request; embeddings carry a 1536-float vector each, so they
+# go in smaller requests to stay well under PostgREST's body limit
+UPSERT_CHUNK_ROWS = int(os.getenv("UPSERT_CHUNK_ROWS", "1000"))
+EMBEDDING_UPSERT_CHUNK_ROWS = int(os.getenv("EMBEDDING_UPSERT_CHUNK_ROWS", "200"))
+
+
+@with_retry(retries=2, base=0.5, label="Supabase upsert")
+def _upsert_chunk(table: str, chunk: list, returning: ReturnMethod) -> list:
+    # Transient failures (timeouts, 5xx, 429) are retried per chunk
+    return supabase.table(table).upsert(chunk, returning=returning).execute().data
+
+
+def upsert_records(table: str, records: list, key_fields: tuple, chunk_size: int = UPSERT_CHUNK_ROWS,
+                   returning: ReturnMethod = ReturnMethod.representation) -> list:
+    """
+    Upsert rows in requests of at most chunk_size rows.
+    A failed chunk is logged and skipped so the other chunks still land.
+
+    Returns:
+        list: Rows returned by the successful requests (empty with
+            ReturnMethod.minimal, which skips echoing the rows back)
+    """
+    records = dedupe_records(records, key_fields)
+    upserted = []
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        try:
+            upserted.extend(_upsert_chunk(table, chunk, returning))
+        except Exception as e:
+            print(f"Error upserting {len(chunk)} {table} rows (offset {start}): {e}")
+    return upserted
 
 
 # ======================================================
 # User Management
 # ======================================================
 
+# Users read by email (status polling, every chat request). Writes made through
+# this module refresh the entry, so the TTL only bounds staleness from other
+# processes.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_MAX_ENTRIES = 10000
+_user_cache: OrderedDict = OrderedDict()
+_user_cache_lock = threading.Lock()
+# In-flight lookups by email, so concurrent misses share one request
+_user_inflight = {}
+
+
+def _cache_user(user: dict):
+    if not user or not user.get("email"):
+        return
+    with _user_cache_lock:
+        _user_cache[user["email"]] = (time.monotonic() + USER_CACHE_TTL, user)
+        _user_cache.move_to_end(user["email"])
+        while len(_user_cache) > USER_CACHE_MAX_ENTRIES:
+            _user_cache.popitem(last=False)
+
+
+def _forget_user(user_id: str):
+    with _user_cache_lock:
+        for email in [email for email, (_, user) in _user_cache.items() if user.get("uuid") == user_id]:
+            del _user_cache[email]
+
+
 def get_user_by_email(email: str):
-    """Get user by email"""
+    """Get user by email (cached for USER_CACHE_TTL seconds)"""
+    with _user_cache_lock:
+        cached = _user_cache.get(email)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        future = _user_inflight.get(email)
+        owner = future is None
+        if owner:
+            future = _user_inflight[email] = Future()
+    if not owner:
+        return future.result()
+
+    user = None
     try:
         response = supabase.table("users").select("*").eq("email", email).execute()
-        return response.data[0] if response.data else None
+        user = first_row(response)
+        # Misses aren't cached: the user may be created right after
+        _cache_user(user)
     except Exception as e:
         print(f"Error getting user by email: {e}")
-        return None
+    finally:
+        with _user_cache_lock:
+            del _user_inflight[email]
+        future.set_result(user)
+    return user
 
 
 def create_user(email: str, name: str = None):
@@ -35,7 +147,9 @@ def create_user(email: str, name: str = None):
             "init_phase": "not_started",
             "init_progress": 0
         }).execute()
-        return response.data[0] if response.data else None
+        user = first_row(response)
+        _cache_user(user)
+        return user
     except Exception as e:
         print(f"Error creating user: {e}")
         return None
@@ -51,7 +165,13 @@ def update_user_status(user_id: str, status: str, init_phase: str = None, init_p
             update_data["init_progress"] = init_progress
         
         response = supabase.table("users").update(update_data).eq("uuid", user_id).execute()
-        return response.data[0] if response.data else None
+        user = first_row(response)
+        if user:
+            # Progress polling reads through the cache; keep it current
+            _cache_user(user)
+        else:
+            _forget_user(user_id)
+        return user
     except Exception as e:
         print(f"Error updating user status: {e}")
         return None
@@ -63,52 +183,94 @@ def update_user_status(user_id: str, status: str, init_phase: str = None, init_p
 
 def insert_emails(user_id: str, emails: list):
     """Batch insert emails for a user"""
-    try:
-        if not emails:
-            return []
-        
-        # Prepare email records
-        records = []
-        for email in emails:
-            records.append({
-                "id": email["id"],
-                "user_id": user_id,
-                "thread_id": email.get("thread_id"),
-                "body": email.get("snippet", ""),
-                "subject": email.get("subject"),
-                "from_user": email.get("from"),
-                "to_user": email.get("to"),
-                "cc": email.get("cc"),
-                "bcc": email.get("bcc"),
-                "date": email.get("date")
-            })
-        
-        # Batch insert with upsert
-        response = supabase.table("emails").upsert(records).execute()
-        return response.data
-    except Exception as e:
-        print(f"Error inserting emails: {e}")
+    if not emails:
         return []
+    
+    # Prepare email records
+    records = []
+    for email in emails:
+        records.append({
+            "id": email["id"],
+            "user_id": user_id,
+            "thread_id": email.get("thread_id"),
+            "body": email.get("snippet", ""),
+            "subject": email.get("subject"),
+            "from_user": email.get("from"),
+            "to_user": email.get("to"),
+            "cc": email.get("cc"),
+            "bcc": email.get("bcc"),
+            "date": email.get("date")
+        })
+    
+    # Batch insert with upsert
+    return upsert_records("emails", records, ("id", "user_id"))
+
+
+@with_retry(retries=3, base=0.5, retryable=lambda e: True, label="get_emails_by_thread")
+def _select_thread_emails(user_id: str, thread_id: str):
+    response = supabase.table("emails").select("*").eq("user_id", user_id).eq("thread_id", thread_id).order("date").execute()
+    return response.data
 
 
-def get_emails_by_thread(user_id: str, thread_id: str, max_retries: int = 3):
+def get_emails_by_thread(user_id: str, thread_id: str):
     """Get all emails in a thread with retry logic"""
-    import time
-    
-    for attempt in range(max_retries):
+    try:
+        return _select_thread_emails(user_id, thread_id)
+    except Exception:
+        return []
+
+
+# Thread ids per request in get_emails_by_threads (keeps the in.() URL short)
+THREAD_LOOKUP_BATCH = 100
+
+
+# Rows per page of a get_emails_by_threads request (at most PostgREST's max-rows)
+THREAD_LOOKUP_PAGE_ROWS = 1000
+
+
+@with_retry(retries=3, base=0.5, retryable=lambda e: True, label="get_emails_by_threads")
+def _select_threads_emails_page(user_id: str, thread_ids: list, columns: str, start: int):
+    response = (
+        supabase.table("emails").select(columns)
+        .eq("user_id", user_id)
+        .in_("thread_id", thread_ids)
+        .order("date").order("id")
+        .range(start, start + THREAD_LOOKUP_PAGE_ROWS - 1)
+        .execute()
+    )
+    return response.data
+
+
+def _select_threads_emails(user_id: str, thread_ids: list, columns: str):
+    """All emails of these threads, paged so PostgREST's row cap can't cut them off"""
+    emails = []
+    start = 0
+    while True:
+        page = _select_threads_emails_page(user_id, thread_ids, columns, start)
+        emails.extend(page)
+        if len(page) < THREAD_LOOKUP_PAGE_ROWS:
+            return emails
+        start += THREAD_LOOKUP_PAGE_ROWS
+
+
+def get_emails_by_threads(user_id: str, thread_ids, columns: str = "*") -> dict:
+    """
+    Get the emails of many threads with a few requests instead of one per thread.
+
+    Returns:
+        dict: {thread_id: [emails ordered by date]}; threads whose request
+            failed are absent
+    """
+    thread_ids = list(dict.fromkeys(thread_ids))
+    threads = {}
+    for start in range(0, len(thread_ids), THREAD_LOOKUP_BATCH):
+        batch = thread_ids[start:start + THREAD_LOOKUP_BATCH]
         try:
-            response = supabase.table("emails").select("*").eq("user_id", user_id).eq("thread_id", thread_id).order("date").execute()
-            return response.data
+            for email in _select_threads_emails(user_id, batch, columns):
+                threads.setdefault(email["thread_id"], []).append(email)
         except Exception as e:
-            if attempt < max_retries - 1:
-                # Exponential backoff: 0.5s, 1s, 2s
-                wait_time = 0.5 * (2 ** attempt)
-                print(f"Error getting emails by thread (attempt {attempt + 1}/{max_retries}): {e}. Retrying in {wait_time}s...")
-                time.sleep(wait_time)
-            else:
-                print(f"Error getting emails by thread after {max_retries} attempts: {e}")
-                return []
-    return []
+            print(f"Error getting emails for {len(batch)} threads: {e}")
+    return threads
 
 
 # ======================================================
@@ -116,40 +278,35 @@ def get_emails_by_thread(user_id: str, thread_id: str, max_retries: int = 3):
 # ======================================================
 
 def insert_schedules(user_id: str, schedules: list):
-    """Batch insert schedules for a user"""
-    try:
-        if not schedules:
-            return []
-        
-        # Prepare schedule records
-        records = []
-        for schedule in schedules:
-            # Parse start and end times
-            start = schedule.get("start", {})
-            end = schedule.get("end", {})
-            start_time = start.get("dateTime") or start.get("date")
-            end_time = end.get("dateTime") or end.get("date")
-            
-            records.append({
-                "id": schedule["id"],
-                "user_id": user_id,
-                "summary": schedule.get("summary"),
-                "description": schedule.get("description"),
-                "location": schedule.get("location"),
-                "start_time": start_time,
-                "end_time": end_time,
-                "creator_email": schedule.get("creator_email"),
-                "organizer_email": schedule.get("organizer_email"),
-                "html_link": schedule.get("html_link"),
-                "updated": schedule.get("updated")
-            })
-        
-        # Batch insert with upsert
-        response = supabase.table("schedules").upsert(records).execute()
-        return response.data
-    except Exception as e:
-        print(f"Error inserting schedules: {e}")
+    """Batch insert schedules for a user (raw Calendar API event objects)"""
+    if not schedules:
         return []
+    
+    # Prepare schedule records
+    records = []
+    for schedule in schedules:
+        # Parse start and end times
+        start = schedule.get("start", {})
+        end = schedule.get("end", {})
+        start_time = start.get("dateTime") or start.get("date")
+        end_time = end.get("dateTime") or end.get("date")
+        
+        records.append({
+            "id": schedule["id"],
+            "user_id": user_id,
+            "summary": schedule.get("summary"),
+            "description": schedule.get("description"),
+            "location": schedule.get("location"),
+            "start_time": start_time,
+            "end_time": end_time,
+            "creator_email": schedule.get("creator", {}).get("email"),
+            "organizer_email": schedule.get("organizer", {}).get("email"),
+            "html_link": schedule.get("htmlLink"),
+            "updated": schedule.get("updated")
+        })
+    
+    # Batch insert with upsert
+    return upsert_records("schedules", records, ("id", "user_id"))
 
 
 # ======================================================
@@ -158,87 +315,104 @@ def insert_schedules(user_id: str, schedules: list):
 
 def insert_files(user_id: str, files: list):
     """Batch insert files for a user"""
-    try:
-        if not files:
-            return []
-        
-        # Prepare file records
-        records = []
-        for file in files:
-            records.append({
-                "id": file["id"],
-                "user_id": user_id,
-                "owner_email": file.get("owner_email"),
-                "owner_name": file.get("owner_name"),
-                "path": file.get("path"),
-                "name": file.get("name"),
-                "mime_type": file.get("mime_type"),
-                "size": file.get("size"),
-                "modified_time": file.get("modified_time"),
-                "parents": file.get("parents", []),
-                "summary": None,  # Will be filled during processing
-                "metadata": file.get("metadata")  # Store rich metadata from Google Drive API
-            })
-        
-        # Batch insert with upsert
-        response = supabase.table("files").upsert(records).execute()
-        return response.data
-    except Exception as e:
-        print(f"Error inserting files: {e}")
+    if not files:
         return []
+    
+    # Prepare file records
+    records = []
+    for file in files:
+        records.append({
+            "id": file["id"],
+            "user_id": user_id,
+            "owner_email": file.get("owner_email"),
+            "owner_name": file.get("owner_name"),
+            "path": file.get("path"),
+            "name": file.get("name"),
+            "mime_type": file.get("mime_type"),
+            "size": file.get("size"),
+            "modified_time": file.get("modified_time"),
+            "parents": file.get("parents", []),
+            "summary": None,  # Will be filled during processing
+            "metadata": file.get("metadata")  # Store rich metadata from Google Drive API
+        })
+    
+    # Batch insert with upsert (a file shared into several folders is listed once per folder)
+    return upsert_records("files", records, ("id", "user_id"))
 
 
 def update_file_summary(user_id: str, file_id: str, summary: str):
     """Update file summary after processing"""
     try:
         response = supabase.table("files").update({"summary": summary}).eq("user_id", user_id).eq("id", file_id).execute()
-        return response.data[0] if response.data else None
+        return first_row(response)
     except Exception as e:
         print(f"Error updating file summary: {e}")
         return None
 
 
+def update_file_summaries(user_id: str, summaries: dict):
+    """
+    Set the summary of many files at once ({file_id: summary}).
+    Sent as one upsert of (id, user_id, summary) rows instead of one UPDATE
+    per file; only those columns are written on conflict.
+    """
+    records = [
+        {"id": file_id, "user_id": user_id, "summary": summary}
+        for file_id, summary in summaries.items()
+    ]
+    return upsert_records("files", records, ("id", "user_id"))
+
+
 # ======================================================
 # Attachment Management
 # ======================================================
 
 def insert_attachments(user_id: str, attachments: list):
     """Batch insert attachments for a user"""
-    try:
-        if not attachments:
-            return []
-        
-        # Prepare attachment records
-        records = []
-        for attachment in attachments:
-            records.append({
-                "id": attachment["id"],
-                "user_id": user_id,
-                "email_id": attachment["email_id"],
-                "filename": attachment.get("filename"),
-                "mime_type": attachment.get("mime_type"),
-                "size": attachment.get("size"),
-                "summary": None  # Will be filled during processing
-            })
-        
-        # Batch insert with upsert
-        response = supabase.table("attachments").upsert(records).execute()
-        return response.data
-    except Exception as e:
-        print(f"Error inserting attachments: {e}")
+    if not attachments:
         return []
+    
+    # Prepare attachment records
+    records = []
+    for attachment in attachments:
+        records.append({
+            "id": attachment["id"],
+            "user_id": user_id,
+            "email_id": attachment["email_id"],
+            "filename": attachment.get("filename"),
+            "mime_type": attachment.get("mime_type"),
+            "size": attachment.get("size"),
+            "summary": None  # Will be filled during processing
+        })
+    
+    # Batch insert with upsert
+    return upsert_records("attachments", records, ("id", "user_id"))
 
 
 def update_attachment_summary(user_id: str, attachment_id: str, summary: str):
     """Update attachment summary after processing"""
     try:
         response = supabase.table("attachments").update({"summary": summary}).eq("user_id", user_id).eq("id", attachment_id).execute()
-        return response.data[0] if response.data else None
+        return first_row(response)
     except Exception as e:
         print(f"Error updating attachment summary: {e}")
         return None
 
 
+def update_attachment_summaries(user_id: str, summaries: list):
+    """
+    Set the summary of many attachments at once.
+    summaries holds dicts with id, email_id and summary (email_id is NOT NULL,
+    so the upsert rows must carry it); one upsert replaces one UPDATE per
+    attachment.
+    """
+    records = [
+        {"id": item["id"], "user_id": user_id, "email_id": item["email_id"], "summary": item["summary"]}
+        for item in summaries
+    ]
+    return upsert_records("attachments", records, ("id", "user_id"))
+
+
 def get_attachments_by_email(user_id: str, email_id: str):
     """Get all attachments for an email"""
     try:
@@ -249,10 +423,55 @@ def get_attachments_by_email(user_id: str, email_id: str):
         return []
 
 
+ATTACHMENT_INDEX_PAGE_ROWS = 1000
+
+
+def build_attachments_index(user_id: str, columns: str = "id, email_id, filename, mime_type, summary") -> dict:
+    """
+    Fetch all of a user's attachments once, grouped by email.
+    Replaces one get_attachments_by_email request per email with a few
+    paged reads (ATTACHMENT_INDEX_PAGE_ROWS rows each).
+
+    Returns:
+        dict: {email_id: [attachment rows]}
+    """
+    index = {}
+    start = 0
+    try:
+        while True:
+            response = (
+                supabase.table("attachments").select(columns)
+                .eq("user_id", user_id)
+                .order("email_id").order("id")
+                .range(start, start + ATTACHMENT_INDEX_PAGE_ROWS - 1)
+                .execute()
+            )
+            for attachment in response.data:
+                index.setdefault(attachment["email_id"], []).append(attachment)
+            if len(response.data) < ATTACHMENT_INDEX_PAGE_ROWS:
+                break
+            start += ATTACHMENT_INDEX_PAGE_ROWS
+    except Exception as e:
+        print(f"Error building attachments index: {e}")
+    return index
+
+
 # ======================================================
 # Embedding Management
 # ======================================================
 
+def to_pgvector(vector) -> str:
+    """
+    pgvector text literal for a vector.
+    The column stores float4, whose values round-trip exactly through 9
+    significant digits; the JSON body is ~40% smaller than with Python's
+    full float repr.
+    """
+    if isinstance(vector, str):
+        return vector
+    return "[" + ",".join([f"{x:.9g}" for x in vector]) + "]"
+
+
 def insert_embedding(user_id: str, embedding_id: str, embedding_type: str, vector: list, 
                      email_id: str = None, schedule_id: str = None, file_id: str = None, attachment_id: str = None):
     """Insert a single embedding"""
@@ -261,7 +480,7 @@ def insert_embedding(user_id: str, embedding_id: str, embedding_type: str, vecto
             "id": embedding_id,
             "user_id": user_id,
             "type": embedding_type,
-            "vector": vector,
+            "vector": to_pgvector(vector),
             "email_id": email_id,
             "schedule_id": schedule_id,
             "file_id": file_id,
@@ -269,20 +488,114 @@ def insert_embedding(user_id: str, embedding_id: str, embedding_type: str, vecto
         }
         
         response = supabase.table("embeddings").upsert(record).execute()
-        return response.data[0] if response.data else None
+        return first_row(response)
     except Exception as e:
         print(f"Error inserting embedding: {e}")
         return None
 
 
 def batch_insert_embeddings(embeddings: list):
-    """Batch insert embeddings"""
+    """
+    Batch insert embeddings.
+    Vectors are sent as compact pgvector literals and the rows are not echoed
+    back (callers never read them), so the result is always [].
+    """
+    if not embeddings:
+        return []
+    
+    records = [{**embedding, "vector": to_pgvector(embedding["vector"])} for embedding in embeddings]
+    return upsert_records("embeddings", records, ("id", "user_id", "type"), EMBEDDING_UPSERT_CHUNK_ROWS,
+                          returning=ReturnMethod.minimal)
+
+
+# ======================================================
+# Search Result Hydration
+# ======================================================
+
+# Shared pool for concurrent per-type hydration queries (at most 4 per call)
+HYDRATION_WORKERS = int(os.getenv("HYDRATION_WORKERS", "8"))
+_hydration_executor = ThreadPoolExecutor(max_workers=HYDRATION_WORKERS, thread_name_prefix="hydrate")
+
+# Guards row caches shared by concurrent hydrations of one agent run
+row_cache_lock = threading.Lock()
+
+# Table holding the rows for each search result type
+RESULT_TABLES = {
+    "email": "emails",
+    "schedule": "schedules",
+    "file": "files",
+    "attachment": "attachments",
+}
+
+
+def get_rows_by_ids(table: str, user_id: str, ids: list, columns: str = "*") -> dict:
+    """
+    Fetch many rows of one table in a single request.
+
+    Args:
+        table: Table name
+        user_id: Owner of the rows
+        ids: Row ids to fetch (duplicates are collapsed)
+        columns: PostgREST select list; must include "id"
+
+    Returns:
+        dict: Row keyed by id; ids that don't exist are simply absent
+    """
+    unique_ids = list(dict.fromkeys(ids))
+    if not unique_ids:
+        return {}
     try:
-        if not embeddings:
-            return []
-        
-        response = supabase.table("embeddings").upsert(embeddings).execute()
-        return response.data
+        response = supabase.table(table).select(columns).eq("user_id", user_id).in_("id", unique_ids).execute()
+        return {row["id"]: row for row in response.data}
     except Exception as e:
-        print(f"Error batch inserting embeddings: {e}")
-        return []
+        print(f"Error fetching {table} rows by id: {e}")
+        return {}
+
+
+def get_result_rows(user_id: str, results: list, columns: dict = None, cache: dict = None) -> dict:
+    """
+    Fetch the rows behind a list of search results, one request per type
+    instead of one per result.
+
+    Args:
+        user_id: User UUID
+        results: Search results carrying 'type' and 'id'
+        columns: Optional select list per result type (defaults to "*")
+        cache: Optional {(type, id): row} shared across calls (e.g. one agent
+            run, whose tool calls may hydrate concurrently); cached rows are
+            not fetched again and new rows are added under row_cache_lock
+
+    Returns:
+        dict: Row keyed by (type, id), for the requested results only
+    """
+    keys = [(result["type"], result["id"]) for result in results if result["type"] in RESULT_TABLES]
+    rows = {}
+    if cache is not None:
+        with row_cache_lock:
+            rows = {key: cache[key] for key in keys if key in cache}
+
+    ids_by_type = {}
+    for result_type, result_id in keys:
+        if (result_type, result_id) not in rows:
+            ids_by_type.setdefault(result_type, []).append(result_id)
+
+    def fetch(item):
+        result_type, ids = item
+        select = (columns or {}).get(result_type, "*")
+        return result_type, get_rows_by_ids(RESULT_TABLES[result_type], user_id, ids, select)
+
+    # The per-type requests are independent: overlap them when there is more than one
+    if len(ids_by_type) > 1:
+        fetched = list(_hydration_executor.map(fetch, ids_by_type.items()))
+    else:
+        fetched = [fetch(item) for item in ids_by_type.items()]
+
+    new_rows = {}
+    for result_type, rows_by_id in fetched:
+        for row_id, row in rows_by_id.items():
+            new_rows[(result_type, row_id)] = row
+    rows.update(new_rows)
+    if cache is not None and new_rows:
+        with row_cache_lock:
+            cache.update(new_rows)
+    return rows
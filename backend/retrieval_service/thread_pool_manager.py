@@ -13,6 +13,8 @@ load_dotenv()
 # Global configuration
 MAX_WORKERS_PER_USER = int(os.getenv("MAX_WORKERS_PER_USER", "5"))
 MAX_TOTAL_WORKERS = int(os.getenv("MAX_TOTAL_WORKERS", "20"))
+# Threads used to fan out lightweight, I/O-bound Google API reads (e.g. Gmail messages.get)
+MAX_FETCH_WORKERS = int(os.getenv("MAX_FETCH_WORKERS", "10"))
 
 
 class GlobalThreadPoolManager: